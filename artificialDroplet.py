@@ -13,7 +13,6 @@ Created on Mon Dec  6 14:50:39 2021
 import pandas as pd
 import numpy as np
 import networkx as nx
-import matplotlib as mpl
 
 from utilitaries import simpleToEdgeList
 from clusteringCoefficient import weightedCC, unweightedCC, multigraphClustering
@@ -105,23 +104,6 @@ def artificialDroplet(size, max_dist):
 #         )
 
 
-df = artificialDroplet(125, 1.5)
-
-dct = {}
-# for k in range(1,2):
-df_edges = simpleToEdgeList(df, 1)
-G, avgWCC = unweightedCC(df_edges)
-dct[1] = avgWCC
-color_lookup = {k:v for k, v in enumerate([value for value in multigraphClustering(G)])}
-
-low, *_, high = sorted(color_lookup.values())
-norm = mpl.colors.Normalize(vmin=low, vmax=high, clip=True)
-mapper = mpl.cm.ScalarMappable(norm=norm, cmap=mpl.cm.coolwarm)
-nx.draw(G,
-        node_color=[mapper.to_rgba(i) 
-                    for i in color_lookup.values()]
-        )
-
 def squareCC(size):
     """
     Return the average clustering coefficient of a cubic droplet of a certain 
@@ -166,4 +148,25 @@ def cubeCC(size):
     core = 132/325
     
     CC = 8*vertice + 12*(size-2)*edge + 6*(size-2)**2*facet + (size-2)**3*core
-    return CC/size**3
\ No newline at end of file
+    return CC/size**3
+
+
+if __name__ == '__main__':
+    import matplotlib as mpl
+    
+    df = artificialDroplet(125, 1.5)
+    
+    dct = {}
+    # for k in range(1,2):
+    df_edges = simpleToEdgeList(df, 1)
+    G, avgWCC = unweightedCC(df_edges)
+    dct[1] = avgWCC
+    color_lookup = {k:v for k, v in enumerate([value for value in multigraphClustering(G)])}
+    
+    low, *_, high = sorted(color_lookup.values())
+    norm = mpl.colors.Normalize(vmin=low, vmax=high, clip=True)
+    mapper = mpl.cm.ScalarMappable(norm=norm, cmap=mpl.cm.coolwarm)
+    nx.draw(G,
+            node_color=[mapper.to_rgba(i) 
+                        for i in color_lookup.values()]
+            )
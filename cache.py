@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content addressed cache of the outputs of the stages.
+"""
+
+# =============================================================================
+## Library dependancies
+# =============================================================================
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from os.path import isdir, join
+
+# =============================================================================
+## Stage cache
+# =============================================================================
+
+"""
+The outputs of a stage for one frame are cached under a key made of the
+sha256 hash of the input files and of the parameters of the stage, so the
+results of a parameter sweep are kept side by side and an unchanged input is
+never computed twice. Each entry is a directory {cache}/{key[:2]}/{key}
+holding the output files, named entry followed by their suffix (.pkl, .frame,
+.npz). The entries are evicted by least recent use when the cache grows
+larger than its size limit at the end of a batch, the use being recorded in
+the entry mtime.
+"""
+
+ENTRY = 'entry'
+
+
+def fileHash(file_path):
+    """
+    Return the sha256 hash of the content of a file.
+
+    Parameters:
+    -----------
+    file_path: string or Path
+        The file.
+
+    Returns:
+    --------
+    digest: string
+        The hexadecimal hash.
+    """
+    
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def pathHash(path):
+    """
+    Return the sha256 hash of a file, or of the names and contents of the
+    files of a directory (like a .frame).
+
+    Parameters:
+    -----------
+    path: string or Path
+        The file or directory.
+
+    Returns:
+    --------
+    digest: string
+        The hexadecimal hash.
+    """
+    
+    if not isdir(path):
+        return fileHash(path)
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        h.update(name.encode())
+        h.update(pathHash(join(path, name)).encode())
+    return h.hexdigest()
+
+
+def cacheKey(file_paths, stage, params):
+    """
+    Return the cache key of a stage on some input files.
+
+    Parameters:
+    -----------
+    file_paths: list of strings or Paths
+        The input files of the stage, the ones that do not exist are skipped.
+    stage: string
+        Name of the stage.
+    params: dict
+        The parameters of the stage changing its outputs.
+
+    Returns:
+    --------
+    key: string
+        The hexadecimal key.
+    """
+    
+    h = hashlib.sha256()
+    h.update(json.dumps({'stage': stage, 'params': params}, sort_keys=True).encode())
+    for file_path in file_paths:
+        if os.path.exists(file_path):
+            h.update(Path(file_path).name.encode())
+            h.update(pathHash(file_path).encode())
+    return h.hexdigest()
+
+
+def entryPath(cache_path, key):
+    """
+    Return the directory of a cache entry.
+    """
+    
+    return Path(cache_path).joinpath(key[:2], key)
+
+
+def pathSize(path):
+    """
+    Return the size in bytes of a file or of all the files of a directory.
+    """
+    
+    if not isdir(path):
+        return os.path.getsize(path)
+    return sum(pathSize(join(path, name)) for name in os.listdir(path))
+
+
+def copyPath(source, target):
+    """
+    Copy a file or a directory, replacing the target.
+    """
+    
+    if isdir(target):
+        shutil.rmtree(target)
+    if isdir(source):
+        shutil.copytree(source, target)
+    else:
+        shutil.copyfile(source, target)
+
+
+def cacheLoad(cache_path, key, save_stem):
+    """
+    Restore the outputs of a cache entry.
+
+    Parameters:
+    -----------
+    cache_path: string or Path
+        The cache directory.
+    key: string
+        The key of the entry, see cacheKey.
+    save_stem: string or Path
+        Name of the outputs without suffix, the suffix of each cached file is
+        appended.
+
+    Returns:
+    --------
+    hit: bool
+        True if the entry exists and was restored.
+    """
+    
+    entry = entryPath(cache_path, key)
+    if not isdir(entry):
+        return False
+    
+    for name in os.listdir(entry):
+        copyPath(entry.joinpath(name), str(save_stem) + name[len(ENTRY):])
+    # the mtime of the entry records its last use
+    os.utime(entry)
+    return True
+
+
+def cacheStore(cache_path, key, save_stem, suffixes):
+    """
+    Save outputs in a cache entry. Nothing is evicted, see cacheEvict.
+
+    Parameters:
+    -----------
+    cache_path: string or Path
+        The cache directory.
+    key: string
+        The key of the entry, see cacheKey.
+    save_stem: string or Path
+        Name of the outputs without suffix.
+    suffixes: list of strings
+        The suffixes of the outputs, like ['.pkl', '.npz'].
+
+    Returns:
+    --------
+    Nothing directly. The entry is saved in the cache directory, an entry
+    already stored under the same key is kept.
+    """
+    
+    entry = entryPath(cache_path, key)
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    # a staging directory of its own, several processes may store the same key
+    tmp_entry = Path(tempfile.mkdtemp(prefix=entry.name + '.', suffix='.tmp', dir=entry.parent))
+    for suffix in suffixes:
+        copyPath(str(save_stem) + suffix, tmp_entry.joinpath(ENTRY + suffix))
+    
+    try:
+        os.replace(tmp_entry, entry)
+    except OSError:
+        # the same outputs were stored meanwhile, keep them
+        if not isdir(entry):
+            raise
+        shutil.rmtree(tmp_entry)
+        os.utime(entry)
+
+
+def cacheEvict(cache_path, max_size, keep = None):
+    """
+    Remove the least recently used entries until the cache is not larger than
+    max_size. The whole cache is scanned, so the stages evict once at the end
+    of a batch rather than after each store.
+
+    Parameters:
+    -----------
+    cache_path: string or Path
+        The cache directory.
+    max_size: int
+        Size limit of the cache in bytes.
+    keep: string, default None
+        Key of an entry that is never removed.
+
+    Returns:
+    --------
+    Nothing directly. The entries are removed from the cache directory.
+    """
+    
+    if not isdir(cache_path):
+        return
+    
+    entries = []
+    for prefix in os.listdir(cache_path):
+        prefix_path = Path(cache_path).joinpath(prefix)
+        if not isdir(prefix_path):
+            continue
+        for key in os.listdir(prefix_path):
+            entry = prefix_path.joinpath(key)
+            if isdir(entry) and not key.endswith('.tmp'):
+                try:
+                    entries += [(os.path.getmtime(entry), key, entry, pathSize(entry))]
+                except FileNotFoundError:
+                    # evicted by another process meanwhile
+                    continue
+    entries.sort()
+    
+    size = sum(elem[3] for elem in entries)
+    for mtime, key, entry, entry_size in entries:
+        if size <= max_size:
+            break
+        if key != keep:
+            shutil.rmtree(entry, ignore_errors=True)
+            size -= entry_size
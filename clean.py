@@ -10,21 +10,50 @@ Created on Fri Jul  3 18:42:01 2020
 # Libraries
 #=============================================================================
 
+import numpy as np
 import pandas as pd
 import os
-import shutil
 import re
+import json
 from pathlib import Path
 from os.path import isfile, join
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from storage import saveFrame, FORMATS
+from cache import fileHash
 
 #=============================================================================
 # Cleaning
 #=============================================================================
 
+# Columns of the .rst files kept for each type of boundary: polyIndex,
+# beadType and the coordinates (columns 5-7 with pbc, 8-10 without)
+RST_COLUMNS = {'pbc': [0, 3, 5, 6, 7], 'npbc': [0, 3, 8, 9, 10]}
+RST_DTYPES = {'polyIndex': np.int32, 'beadType': np.int32,
+              'x': np.float32, 'y': np.float32, 'z': np.float32}
+
+def countLines(filename, block_size = 1 << 20):
+    """
+    Return the number of lines of a text file, an upper bound of the number
+    of rows parsed from it (blank lines are skipped by the parser).
+    """
+    
+    n = 0
+    last = b'\n'
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            n += block.count(b'\n')
+            last = block[-1:]
+    return n + (last != b'\n')
+
+
 # Import data and convert them to dataframe
-def clean(filename, boundary):
+def clean(filename, boundary, chunk_size = 1000000):
     """
-    Clean the files, only keeping the relevant data.
+    Clean the files, only keeping the relevant data. Only the needed columns
+    are parsed, chunk_size lines at a time, into columns allocated once for
+    the whole file, so the memory used is the cleaned dataframe and one
+    chunk.
 
     Parameters:
     -----------
@@ -33,54 +62,43 @@ def clean(filename, boundary):
         with 14 columns.
     boundary: string, accept only 'pbc' or 'npbc'
         Type of boundary used. Determine which coordinates we will keep.
+    chunk_size: int, default 1000000
+        Number of lines parsed at once.
 
     Returns:
     --------
-    df_pbc or df_npbc: pandas dataframe
-        The cleaned dataframe.
-    """
-    
-    col_names = ['polyIndex',
-           'polyType',
-           'beadIndex',
-           'beadType',
-           'a',
-           'x', 'y', 'z',
-           'x_npbc', 'y_npbc', 'z_npbc',
-           'b', 'c', 'd'] 
-    df = pd.read_csv(filename,
-                 names=col_names,
-                 header=None,
-                 sep = ' ',
-                 index_col=False)
-    
-    if boundary == 'pbc':
-        # Clean data (delete columns 2, 5, 12-14) by removing non used columns
-        df_pbc = df.drop(['polyType', 'a', 'b', 'c', 'd', 'x_npbc', 'y_npbc', 'z_npbc'], axis=1)
-        header_list_pbc = ['polyIndex', 'beadIndex', 'beadType', 'beadPosition', 'x', 'y',
-                'z']
-        df_pbc = df_pbc.reindex(columns = header_list_pbc)
-        # Drop useless labels
-        df_pbc.drop(['beadIndex'], axis=1, inplace=True)
-        
-        return df_pbc
-    
-    elif boundary == 'npbc':
-        # Clean data (delete columns 2, 5, 12-14) by removing non used columns
-        df_npbc = df.drop(['polyType', 'a', 'b', 'c', 'd', 'x', 'y', 'z'], axis=1)
-       
-        header_list_npbc = ['polyIndex', 'beadIndex', 'beadType', 'beadPosition', 'x_npbc', 'y_npbc',
-                'z_npbc']
-        df_npbc = df_npbc.reindex(columns = header_list_npbc)
-        df_npbc.rename({'x_npbc': 'x', 'y_npbc': 'y', 'z_npbc': 'z'},inplace=True)
-        # Drop useless labels
-        df_npbc.drop(['beadIndex'], axis=1, inplace=True)
-             
-        return df_npbc
-    
-    else:
+    df: pandas dataframe
+        The cleaned dataframe, with the columns polyIndex, beadType,
+        beadPosition (empty, see BS_tag), x, y and z.
+    """
+    
+    if boundary not in RST_COLUMNS:
         print('Boundaries of type {} are not understood, please use pbc for'.format(boundary) +
               ' periodic boundaries or npbc for non periodic ones.')
+        return None
+    
+    n = countLines(filename)
+    columns = {name: np.empty(n, dtype=dtype) for name, dtype in RST_DTYPES.items()}
+    
+    chunks = pd.read_csv(filename,
+                         names=list(RST_DTYPES),
+                         usecols=RST_COLUMNS[boundary],
+                         dtype=RST_DTYPES,
+                         header=None,
+                         sep = ' ',
+                         index_col=False,
+                         chunksize=chunk_size)
+    filled = 0
+    for chunk in chunks:
+        for name in columns:
+            columns[name][filled:filled+len(chunk)] = chunk[name].to_numpy()
+        filled += len(chunk)
+    
+    # the columns are used as they are, without a copy
+    data = {name: columns[name][:filled] for name in ['polyIndex', 'beadType']}
+    data['beadPosition'] = np.full(filled, np.nan)
+    data.update({name: columns[name][:filled] for name in ['x', 'y', 'z']})
+    return pd.DataFrame(data, copy=False)
 
 #=============================================================================
 # Formating
@@ -104,48 +122,177 @@ def BS_tag(data):
     """
     
     data2 = data.copy(deep=True)
-    L = []
     
     """
-    For each polyIndex we create a small dataframe and label the beads if they
-    are not in the backbone by the index of the first one in the chain and by
-    -1 otherwise. So the beads in the first bidding site will all be labeled 0, etc.
+    The beads that are not in the backbone are labeled by the number of
+    backbone beads before them on their polymer (cumulative sum of the
+    backbone mask by polyIndex). So the beads in the first bidding site will
+    all be labeled 0, etc.
     """
-    for elem in data2.groupby(['polyIndex']).mean().index.to_list():
-        beadP = 0
-        working_df = data2.loc[data2['polyIndex'] == elem, 'beadType']
-        idx = working_df.index.to_list()
-        for k in idx:
-            if working_df.at[k] != 2:
-                L += [beadP]
-            else:
-                L += [-1]
-                beadP += 1
+    backbone = data2['beadType'] == 2
+    data2['beadPosition'] = backbone.astype('int64').groupby(data2['polyIndex']).cumsum()
     
     # Drop the irrelevant beads (backbone)
-    data2['beadPosition'] = L
-    index_drops = data2[data2['beadType'] == 2].index
-    data2.drop(index_drops,inplace=True)
+    data2 = data2.loc[~backbone]
     
     # Aggregate each bidding site
     data3 = data2.groupby(['polyIndex','beadPosition']).mean().reset_index()
     
     # Relabel by their position on the polymer (needed for linear links)
-    positions = list(data3['beadPosition'].unique())
-    data3['beadPosition'] = data3['beadPosition'].apply(lambda x: positions.index(x))
+    data3['beadPosition'] = pd.factorize(data3['beadPosition'])[0]
     
     data3 = data3.astype({'beadPosition': 'int64'})
     return data3
 
 
+#=============================================================================
+# Incremental conversion
+#=============================================================================
+
+MANIFEST = '.clean_manifest.json'
+
+
+def cleanName(file_name):
+    """
+    Return the name of a cleaned file, with the timestep padded with zeros
+    so that the files are sorted by timestep.
+
+    Parameters:
+    -----------
+    file_name: string
+        Name of the .rst file without its suffix.
+
+    Returns:
+    --------
+    file_name: string
+        The padded name.
+    """
+    
+    if re.match(r'[\w.]*con.\d{3,5}$',file_name):
+        if re.match(r'[\w.]*con.\d\d\d$',file_name):
+            file_name = file_name[:-3] + '000' + file_name[-3:]
+        elif re.match(r'[\w.]*con.\d\d\d\d$',file_name):
+            file_name = file_name[:-4] + '00' + file_name[-4:]
+        else:
+            file_name = file_name[:-5] + '0' + file_name[-5:]
+    return file_name
+
+
+def upToDate(file_path, save_name, entry, params):
+    """
+    Tell if the cleaned file save_name is up to date with the raw file
+    file_path: it exists, the manifest shows it was made with the same
+    parameters, and it is newer than the raw file or was made from a raw file
+    with the same content. Without a manifest entry the parameters cannot be
+    checked, so the file is not up to date. A cleaned file older than a raw
+    file with the same content is touched.
+
+    Parameters:
+    -----------
+    file_path: string or Path
+        The raw .rst file.
+    save_name: string or Path
+        The cleaned file.
+    entry: dict or None
+        Entry of the raw file in the manifest, None if it has none.
+    params: dict
+        The parameters of the cleaning.
+
+    Returns:
+    --------
+    up_to_date: bool
+    """
+    
+    if (entry is None) or not os.path.exists(save_name):
+        return False
+    if entry['params'] != params:
+        return False
+    if os.path.getmtime(save_name) >= os.path.getmtime(file_path):
+        return True
+    if entry['sha256'] != fileHash(file_path):
+        return False
+    # same content but a newer raw file (touched or copied): touch the
+    # cleaned file so that the raw file is not hashed again next time
+    os.utime(save_name)
+    return True
+
+
+def cleanFile(file_path, save_stem, boundary, fmt):
+    """
+    Clean one raw file and save it, see main_clean.
+
+    Parameters:
+    -----------
+    file_path: string or Path
+        The raw .rst file.
+    save_stem: string or Path
+        Name of the cleaned file without suffix.
+    boundary: 'pbc' or 'npbc'
+        Type of boundary used.
+    fmt: 'pkl' or 'frame'
+        Format of the saved file.
+
+    Returns:
+    --------
+    digest: string
+        The sha256 hash of the raw file.
+    """
+    
+    df = BS_tag(clean(file_path,boundary))
+    saveFrame(df, save_stem, fmt)
+    return fileHash(file_path)
+
+
+def cleanFiles(tasks, boundary, fmt, workers = 1):
+    """
+    Clean the raw files of tasks, in this process if workers is 1 and in a
+    process pool otherwise, see main_clean.
+
+    Parameters:
+    -----------
+    tasks: list of tuples
+        The name, the path and the save_stem of each raw file.
+    boundary: 'pbc' or 'npbc'
+        Type of boundary used.
+    fmt: 'pkl' or 'frame'
+        Format of the saved files.
+    workers: int, default 1
+        Number of processes.
+
+    Returns:
+    --------
+    results: generator of tuples
+        The name of each raw file, its hash and the error (None if it was
+        cleaned), as they are cleaned.
+    """
+    
+    if workers == 1:
+        for file, file_path, save_stem in tasks:
+            try:
+                yield file, cleanFile(file_path, save_stem, boundary, fmt), None
+            except Exception as error:
+                yield file, None, error
+        return
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(cleanFile, file_path, save_stem, boundary, fmt): file
+                   for file, file_path, save_stem in tasks}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as error:
+                yield futures[future], None, error
+
+
 #=============================================================================
 # Main function to use
 #=============================================================================
 
-def main_clean(dir_in, dir_out, boundary = 'pbc'):
+def main_clean(dir_in, dir_out, boundary = 'pbc', fmt = 'pkl', workers = 1, force = False):
     """
-    Do the neighbours search for a bunch of file and save the result in a (new)
-    directory.
+    Clean a bunch of file and save the result in a (new) directory. The raw
+    files whose cleaned file is up to date (see upToDate) are skipped, so
+    only the new frames of a run are cleaned again.
 
     Parameters:
     -----------
@@ -156,58 +303,79 @@ def main_clean(dir_in, dir_out, boundary = 'pbc'):
         will save the files.
     boundary: string, accept only 'pbc' or 'npbc', default 'pbc'
         Type of boundary used. Determine which coordinates we will keep.
+    fmt: 'pkl' or 'frame', default 'pkl'
+        Format of the saved files, see storage.saveFrame.
+    workers: int, default 1
+        Number of files cleaned in parallel, each in its own process. With 1
+        the files are cleaned in this process.
+    force: bool, default False
+        If True, clean every file even if it is up to date.
 
     Returns:
     --------
-    Nothing directly. The script will save the files in the output directory.
+    Nothing directly. The script will save the files in the output directory,
+    with a manifest of the cleaned raw files. A file that fails is reported
+    and left out of the manifest, the others are still cleaned.
     """
     
+    if boundary not in RST_COLUMNS:
+        raise ValueError('Boundaries of type {} are not understood, please use pbc for'.format(boundary) +
+                         ' periodic boundaries or npbc for non periodic ones.')
+    
     dir_path = Path(os.getcwd())
     path = dir_path.parent.joinpath(dir_in)
 
     # make the outputs directories
     clean_path = dir_path.parent.joinpath(dir_out)
     clean_path.mkdir(parents=True, exist_ok=True)
+    
+    manifest_path = clean_path.joinpath(MANIFEST)
+    manifest = {}
+    if isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    params = {'boundary': boundary, 'fmt': fmt}
 
     # start working on the raw data
-    onlyfiles = [f for f in os.listdir(path) if isfile(join(path, f))]
+    onlyfiles = [f for f in os.listdir(path) if isfile(join(path, f)) and f.endswith('.rst')]
     onlyfiles = sorted(onlyfiles)
     
-    # starting parameters for the counter
-    k = 1
-    n = len(onlyfiles)
+    tasks = []
     for file in onlyfiles:
-        if file.endswith('.rst'):
-            # counter to see progression
-            print("file {:02d} / {}".format(k,n))
-            k += 1
-            file_name = file[:-4]
-            # create clean dataframe from raw data
-            file_path = os.path.join(path,file)
-            df = BS_tag(clean(file_path,boundary))
-            
-            # save cleanded data file in clean_data subfolder
-            if re.match('[\w.]*con.\d{3,5}$',file_name):
-                if re.match('[\w.]*con.\d\d\d$',file_name):
-                    file_name = file_name[:-3] + '000' + file_name[-3:]
-                elif re.match('[\w.]*con.\d\d\d\d$',file_name):
-                    file_name = file_name[:-4] + '00' + file_name[-4:]
-                else:
-                    file_name = file_name[:-5] + '0' + file_name[-5:]
-            savedfile_name = file_name + '.pkl'
-            df.to_pickle(savedfile_name)
-            
-            savedfile_path = clean_path.joinpath(savedfile_name)
-            if os.path.exists(savedfile_path):
-                os.remove(savedfile_path)
-                shutil.move(savedfile_name, clean_path)
+        file_path = path.joinpath(file)
+        save_stem = clean_path.joinpath(cleanName(file[:-4]))
+        save_name = str(save_stem) + FORMATS[fmt]
+        if force or not upToDate(file_path, save_name, manifest.get(file), params):
+            tasks += [(file, file_path, save_stem)]
+    
+    n = len(tasks)
+    print("{} / {} files to clean".format(n, len(onlyfiles)))
+    
+    if n == 0:
+        return
+    
+    failed = []
+    try:
+        # counter to see progression
+        for k, (file, digest, error) in enumerate(cleanFiles(tasks, boundary, fmt, workers)):
+            print("file {:02d} / {}".format(k+1,n))
+            if error is None:
+                manifest[file] = {'sha256': digest, 'params': params}
             else:
-                shutil.move(savedfile_name, clean_path)
-       
-        else:
-            pass
-        
-        
+                # a failed file is cleaned again by the next run
+                print("{} failed: {!r}".format(file, error))
+                manifest.pop(file, None)
+                failed += [file]
+    finally:
+        # keep the hashes of the files cleaned so far, whatever happens
+        tmp_path = manifest_path.with_name(MANIFEST + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, manifest_path)
+    
+    if failed:
+        print("{} / {} files failed".format(len(failed), n))
+
 
 #=============================================================================
 # Tests
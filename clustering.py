@@ -13,15 +13,76 @@ Created on Thu Dec  2 13:48:26 2021
 import os
 import pandas as pd
 import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
 from pathlib import Path
-from os.path import isfile, join
+from os.path import isfile
+
+from utilitaries import loadCSR, pairDistance
+from storage import listFrames, loadFrame, saveFrame, frameStem, FORMATS
+from cache import cacheKey, cacheLoad, cacheStore, cacheEvict
+from executor import runTasks
 
 # =============================================================================
 ## Basic functions
 # =============================================================================
 
 
-def clustering(data, sort = True):
+def findRoot(parent, i):
+    """
+    Return the root of the set containing i in a disjoint-set forest,
+    compressing the path on the way.
+
+    Parameters:
+    -----------
+    parent: list
+        The parent of each element, a root is its own parent.
+    i: int
+        The element.
+
+    Returns:
+    --------
+    root: int
+        The root of the set containing i.
+    """
+    
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+def unionSets(parent, rank, a, b):
+    """
+    Merge two sets of a disjoint-set forest, the root of lower rank is put
+    under the other one.
+
+    Parameters:
+    -----------
+    parent: list
+        The parent of each element, a root is its own parent.
+    rank: list
+        The rank of each root.
+    a, b: int
+        The roots of the two sets.
+
+    Returns:
+    --------
+    root: int
+        The root of the merged set.
+    """
+    
+    if rank[a] < rank[b]:
+        a, b = b, a
+    parent[b] = a
+    if rank[a] == rank[b]:
+        rank[a] += 1
+    return a
+
+
+def clustering(data, sort = True, nearest = None):
     """
     Return a new dataframe containing the junctions, the coordinates of theirs
     centers of masses, theirs members and weight.
@@ -33,6 +94,10 @@ def clustering(data, sort = True):
         named nearest, and two columns named polyIndex and beadPosition
     sort: bool, default True
         Indicate if you want the junction sorted or not.
+    nearest: tuple of numpy arrays, default None
+        The neighbours in compressed sparse row form (offsets, indices,
+        distances), as given by neighborsSearch.neighboursCSR. If None, they
+        are read from the nearest column of data.
 
     Returns:
     --------
@@ -42,54 +107,59 @@ def clustering(data, sort = True):
     """
     
     data2 = data.copy(deep=True)
+    n = len(data2)
+    
+    # neighbours of each row, the members are looked up by index
+    if nearest is None:
+        rows = [[elem[1] for elem in M] for M in data['nearest']]
+    else:
+        offsets, indices = nearest[0], nearest[1]
+        rows = [M.tolist() for M in np.split(indices, offsets[1:-1])]
     
+    """
+    The rows are assembled in junctions with a disjoint-set forest. Each set
+    carries a label at its root: a row without junction opens a new one and
+    when two junctions meet, the one of the row takes the label of the
+    neighbour's. This gives the same labels, thus the same numbering of the
+    junctions, as relabelling every row of the junction.
+    """
+    parent = list(range(n))
+    rank = [0 for i in range(n)]
+    label = [0 for i in range(n)]
     clusters_counter = -1
-    L = [0 for i in range(len(data2))]
-    full_members = {}
-    for k in range(len(data2)):
+    for k in range(n):
+        root = findRoot(parent, k)
         # if row has no cluster assigned, assign one and update the counter
-        if L[k] == 0:
-            L[k] = clusters_counter
+        if label[root] == 0:
+            label[root] = clusters_counter
             clusters_counter -= 1
-        
-        members = [data.iloc[k][['polyIndex','beadPosition']].to_list()]
-        if data.at[k,'nearest'] != []:
-            M = data.at[k,'nearest']
-            for elem in M:
-                neighbour = elem[1]
-                members += [elem[2:]]
-                if L[neighbour] == 0:
-                    L[neighbour] = L[k]
-                else:
-                    I = [index for index, value in enumerate(L) if value == L[k]]
-                    for idx in I:
-                        L[idx] = L[neighbour]
-        try:
-            for member in members:
-                if member not in full_members[L[k]]:
-                    full_members[L[k]] += [member]
-        except KeyError:
-            full_members[L[k]] = members
+        for neighbour in rows[k]:
+            other = findRoot(parent, neighbour)
+            if other != root:
+                new_label = label[other] if label[other] != 0 else label[root]
+                root = unionSets(parent, rank, root, other)
+                label[root] = new_label
+    L = np.array([label[findRoot(parent, k)] for k in range(n)], dtype=np.int64)
     
     data2['junction'] = L
     
-    data2.drop(['polyIndex','beadPosition','beadType','nearest'],axis=1,inplace=True)
+    # Gather the members of each junction by sorting the rows by junction
+    order = np.argsort(L, kind='stable')
+    members = [list(elem) for elem in zip(data['polyIndex'].to_numpy()[order].tolist(),
+                                          data['beadPosition'].to_numpy()[order].tolist())]
+    keys, starts = np.unique(L[order], return_index=True)
+    bounds = np.append(starts, n).tolist()
     
-    data3 = data2.groupby(['junction']).mean().reset_index()
+    data2.drop(['polyIndex','beadPosition','beadType','nearest'],axis=1,inplace=True,
+               errors='ignore')
     
-    M = []
-    for key in data3['junction'].to_list():
-        M += [full_members[key]]
+    data3 = data2.groupby(['junction']).mean().reset_index()
     
-    data3['members'] = M
+    data3['members'] = [members[bounds[i]:bounds[i+1]] for i in range(len(keys))]
     data3['mass'] = data3['members'].apply(len)
     
     # reindexing junction
-    index = 0
-    for junction_number in data3['junction'].unique().tolist():
-        data3.loc[data3['junction'] == junction_number,
-                              ['junction']] = index
-        index += 1
+    data3['junction'] = pd.factorize(data3['junction'])[0]
     if sort:
         data3.sort_values(by = 'junction', inplace=True, kind='quicksort')
         data3 = data3.astype({'junction': 'int64'})
@@ -126,6 +196,9 @@ def links(data_junctions, data_polymers, boundary ,box_size):
     #data_junctions['neighbours'] = [[] for i in range(len(data_junctions))]
     L = []
     length = data_polymers.groupby('polyIndex').count()['beadPosition'].head(1).item()
+    polymers = np.unique(data_polymers['polyIndex'].to_numpy())
+    coordinates = siteCoordinates(data_polymers, polymers,
+                                  int(data_polymers['beadPosition'].max()) + 1)
     if boundary == 'pbc':
         for i in range(len(data_junctions)):
             M = []
@@ -143,16 +216,12 @@ def links(data_junctions, data_polymers, boundary ,box_size):
                 for elem in N:
                     B = K[N.index(elem)]
                     D = []
+                    row = np.searchsorted(polymers, member[0])
                     for elem2 in B:
                         BS_number = elem2[1]
-                        p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == member[1])][['x','y','z']]
-                        p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == BS_number)][['x','y','z']]
- 
-                        x_dist, y_dist, z_dist = abs(p0-p1)
-
-                        D += [np.sqrt(min(x_dist,box_size-x_dist)**2
-                                      + min(y_dist,box_size-y_dist)**2
-                                      + min(z_dist,box_size-z_dist)**2)]
+                        D += [pairDistance(coordinates[row, member[1]],
+                                           coordinates[row, BS_number],
+                                           box_size, boundary)]
                     
                     #data_junctions.at[i,'neighbours'].append((data_junctions.at[elem,'cluster'],min(D),len(B)))
                     M += [[data_junctions.at[elem,'cluster'],min(D),len(B)]]
@@ -169,6 +238,102 @@ def links(data_junctions, data_polymers, boundary ,box_size):
     return data_junctions
 
 
+def junctionLookup(data_junctions, data_polymers):
+    """
+    Return the junction holding each binding site, as a dense array indexed
+    by polymer and bead position.
+
+    Parameters:
+    -----------
+    data_junctions: pandas dataframe
+        data_junctions must contain at least one column named members.
+    data_polymers: pandas dataframe
+        data_polymers must contain at least two columns named polyIndex and
+        beadPosition.
+
+    Returns:
+    --------
+    lookup: numpy array
+        lookup[k, b] is the row of data_junctions holding the binding site b
+        of the polymer polymers[k], -1 if there is none.
+    polymers: numpy array
+        The sorted polyIndex of the polymers, the row k of lookup is the
+        polymer polymers[k].
+    """
+    
+    polymers = np.unique(data_polymers['polyIndex'].to_numpy())
+    width = int(data_polymers['beadPosition'].max()) + 1 if len(data_polymers) else 0
+    lookup = np.full((len(polymers), width), -1, dtype=np.int64)
+    
+    mass = data_junctions['members'].apply(len).to_numpy()
+    if mass.sum() > 0:
+        M = np.array([member for members in data_junctions['members'] for member in members])
+        rows = np.searchsorted(polymers, M[:,0].astype(polymers.dtype))
+        lookup[rows, M[:,1].astype(int)] = np.repeat(np.arange(len(mass)), mass)
+    
+    return lookup, polymers
+
+
+def siteCoordinates(data_polymers, polymers, width):
+    """
+    Return the coordinates of the binding sites as a dense array indexed by
+    polymer and bead position.
+
+    Parameters:
+    -----------
+    data_polymers: pandas dataframe
+        data_polymers must contain at least three columns named x, y and z and 
+        two columns named polyIndex and beadPosition.
+    polymers: numpy array
+        The sorted polyIndex of the polymers, as given by junctionLookup.
+    width: int
+        Number of bead positions.
+
+    Returns:
+    --------
+    coordinates: numpy array
+        Array of shape (len(polymers), width, 3), coordinates[k, b] is the
+        position of the binding site b of the polymer polymers[k], NaN if
+        there is none.
+    """
+    
+    coordinates = np.full((len(polymers), width, 3), np.nan)
+    rows = np.searchsorted(polymers, data_polymers['polyIndex'].to_numpy())
+    coordinates[rows, data_polymers['beadPosition'].to_numpy().astype(int)] = \
+        data_polymers[['x','y','z']].to_numpy(dtype=float)
+    
+    return coordinates
+
+
+def bondLengths(coordinates, boundary, box_size):
+    """
+    Return the distance between every two consecutive binding sites of the
+    polymers.
+
+    Parameters:
+    -----------
+    coordinates: numpy array
+        The coordinates of the binding sites, as given by siteCoordinates.
+    boundary: 'pbc' or 'npbc'
+        Type of boundary.
+    box_size: int
+        Size of the simulation box.
+
+    Returns:
+    --------
+    bonds: numpy array
+        bonds[k, b] is the distance between the binding sites b and b+1 of
+        the polymer k. None if the boundary is not understood.
+    """
+    
+    if boundary not in ['pbc', 'npbc']:
+        print('Boundaries of type {} are not understood, please use pbc for'.format(boundary) +
+              ' periodic boundaries or npbc for non periodic ones.')
+        return None
+    
+    return pairDistance(coordinates[:, :-1], coordinates[:, 1:], box_size, boundary)
+
+
 def linksLinear(data_junctions, data_polymers, boundary, box_size):
     """
     Return a new dataframe containing the junctions, the coordinates of theirs
@@ -195,186 +360,53 @@ def linksLinear(data_junctions, data_polymers, boundary, box_size):
     
     data_junctions['neighbors'] = [[] for i in range(len(data_junctions))]
     length = data_polymers.groupby('polyIndex').count()['beadPosition'].head(1).item()
-    if boundary == 'pbc':    
-        for i in range(len(data_junctions)):
-            N = []
-            for member in data_junctions.iloc[i]['members']:
-                K = [[member[0], i] for i in range(length) if i != member[1]]
-                #print('K: {}'.format(K))
-                if all(elem in data_junctions.iloc[i]['members'] for elem in K):
-                    pass
-                else:
-                    if (member[1] == 0):
-                        j = 0
-                        while not ([member[0],1] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == 0)].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == 1)].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-
-                            distance = np.sqrt(min(x_dist,box_size-x_dist)**2
-                                          + min(y_dist,box_size-y_dist)**2
-                                          + min(z_dist,box_size-z_dist)**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-                            #print('Neighbors of {}: {}'.format(i,N))
-                        
-                    elif (member[1] == (length-1)):
-                        j = 0
-                        while not ([member[0],length-2] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == (length-1))].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == (length-2))].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                            
-                            distance = np.sqrt(min(x_dist,box_size-x_dist)**2
-                                          + min(y_dist,box_size-y_dist)**2
-                                          + min(z_dist,box_size-z_dist)**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-                    else:
-                        b = member[1]
-                        j = 0
-                        while not ([member[0],b-1] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b)].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b-1)].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                            
-                            distance = np.sqrt(min(x_dist,box_size-x_dist)**2
-                                          + min(y_dist,box_size-y_dist)**2
-                                          + min(z_dist,box_size-z_dist)**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-                            
-                        j = 0
-                        while not ([member[0],b+1] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b)].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b+1)].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                            
-                            distance = np.sqrt(min(x_dist,box_size-x_dist)**2
-                                          + min(y_dist,box_size-y_dist)**2
-                                          + min(z_dist,box_size-z_dist)**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-            N.sort()  
-            N1 = list(set([x[0] for x in N]))
-            M = []
-            for elem in N1:
-                N2 = [elm[1] for elm in N if elm[0] == elem]
-                dist = min(N2)
-                strength = len(N2)
-                M += [[elem, dist, strength]]
-            data_junctions.at[i,'neighbors'] = M
-    elif boundary == 'npbc':    
-        for i in range(len(data_junctions)):
-            N = []
-            for member in data_junctions.iloc[i]['members']:
-                K = [[member[0], i] for i in range(length) if i != member[1]]
-                #print('K: {}'.format(K))
-                if all(elem in data_junctions.iloc[i]['members'] for elem in K):
-                    pass
-                else:
-                    if (member[1] == 0):
-                        j = 0
-                        while not ([member[0],1] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == 0)].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == 1)].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-
-                            distance = np.sqrt(x_dist**2
-                                          + y_dist**2
-                                          + z_dist**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-                            #print('Neighbors of {}: {}'.format(i,N))
-                        
-                    elif (member[1] == (length-1)):
-                        j = 0
-                        while not ([member[0],length-2] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == (length-1))].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == (length-2))].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                            
-                            distance = np.sqrt(x_dist**2
-                                          + y_dist**2
-                                          + z_dist**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-                    else:
-                        b = member[1]
-                        j = 0
-                        while not ([member[0],b-1] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b)].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b-1)].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                            
-                            distance = np.sqrt(x_dist**2
-                                          + y_dist**2
-                                          + z_dist**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-                            
-                        j = 0
-                        while not ([member[0],b+1] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b)].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b+1)].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                            
-                            distance = np.sqrt(x_dist**2
-                                          + y_dist**2
-                                          + z_dist**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-            N.sort()  
-            N1 = list(set([x[0] for x in N]))
-            M = []
-            for elem in N1:
-                N2 = [elm[1] for elm in N if elm[0] == elem]
-                dist = min(N2)
-                strength = len(N2)
-                M += [[elem, dist, strength]]
-            data_junctions.at[i,'neighbors'] = M
-    else:
-        print('Boundaries of type {} are not understood, please use pbc for'.format(boundary) +
-              ' periodic boundaries or npbc for non periodic ones.')
+    lookup, polymers = junctionLookup(data_junctions, data_polymers)
+    whole = (lookup[:, :length] == lookup[:, :1]).all(axis=1)
+    
+    bonds = bondLengths(siteCoordinates(data_polymers, polymers, lookup.shape[1]),
+                        boundary, box_size)
+    if bonds is None:
+        return data_junctions
+    junctions = data_junctions['junction'].to_numpy()
+    
+    for i in range(len(data_junctions)):
+        N = []
+        for member in data_junctions.iloc[i]['members']:
+            row = np.searchsorted(polymers, member[0])
+            b = int(member[1])
+            # skip the polymers lying entirely in this junction
+            if whole[row]:
+                continue
+            if b == 0:
+                sides = [1]
+            elif b == length-1:
+                sides = [length-2]
+            else:
+                sides = [b-1, b+1]
+            # the bond min(b, c) links the sites b and c
+            for c in sides:
+                j = lookup[row, c]
+                if j >= 0:
+                    N += [[junctions[j], bonds[row, min(b, c)]]]
+        N.sort()  
+        N1 = list(set([x[0] for x in N]))
+        M = []
+        for elem in N1:
+            N2 = [elm[1] for elm in N if elm[0] == elem]
+            dist = min(N2)
+            strength = len(N2)
+            M += [[elem, dist, strength]]
+        data_junctions.at[i,'neighbors'] = M
+    
     return data_junctions
 
 
 def linksFarLinear(data_junctions, data_polymers, boundary, box_size):
     """
     Return a new dataframe containing the junctions, the coordinates of theirs
-    centers of masses, theirs members and weight.
+    centers of masses, theirs members and weight. Unlike linksLinear, the
+    binding sites that are not bound (alone in their junction) are skipped,
+    each bound site is linked to the nearest bound sites along its polymer.
 
     Parameters:
     -----------
@@ -396,199 +428,48 @@ def linksFarLinear(data_junctions, data_polymers, boundary, box_size):
     """
     
     data_junctions['neighbors'] = [[] for i in range(len(data_junctions))]
-    length = data_polymers.groupby('polyIndex').count()['beadPosition'].head(1).item()
-    if boundary == 'pbc':    
-        for i in range(len(data_junctions)):
-            N = []
-            for member in data_junctions.iloc[i]['members']:
-                K = [[member[0], i] for i in range(length) if i != member[1]]
-                #print('K: {}'.format(K))
-                if all(elem in data_junctions.iloc[i]['members'] for elem in K):
-                    pass
-                else:
-                    if (member[1] == 0):
-                        j = 0
-                        t = True
-                        while t:
-                            for k in range(1,length):
-                                while not ([member[0],k] in data_junctions.iloc[j]['members']):
-                                    j += 1
-                                    if j >= len(data_junctions):
-                                        break
-                                if j < len(data_junctions):
-                                    t = False
-                                    p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == 0)].reset_index()[['x','y','z']]
-                                    p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == 1)].reset_index()[['x','y','z']]
-             
-                                    x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-        
-                                    distance = np.sqrt(min(x_dist,box_size-x_dist)**2
-                                                  + min(y_dist,box_size-y_dist)**2
-                                                  + min(z_dist,box_size-z_dist)**2)
-                                    N += [[data_junctions.at[j,'junction'],distance]]
-                                    #print('Neighbors of {}: {}'.format(i,N))
-                                    break
-                        
-                    elif (member[1] == (length-1)):
-                        j = 0
-                        t = True
-                        while t:
-                            for k in range(length-2, 0, -1):
-                                while not ([member[0],k] in data_junctions.iloc[j]['members']):
-                                    j += 1
-                                    if j >= len(data_junctions):
-                                        break
-                                if j < len(data_junctions):
-                                    t = False
-                                    p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == (length-1))].reset_index()[['x','y','z']]
-                                    p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == (length-2))].reset_index()[['x','y','z']]
-             
-                                    x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                                    
-                                    distance = np.sqrt(min(x_dist,box_size-x_dist)**2
-                                                  + min(y_dist,box_size-y_dist)**2
-                                                  + min(z_dist,box_size-z_dist)**2)
-                                    N += [[data_junctions.at[j,'junction'],distance]]
-                                    break
-                    else:
-                        b = member[1]
-                        j = 0
-                        t = True
-                        while t:
-                            for k in range(b-1, 0, -1):
-                                while not ([member[0],k] in data_junctions.iloc[j]['members']):
-                                    j += 1
-                                    if j >= len(data_junctions):
-                                        break
-                                if j < len(data_junctions):
-                                    t = False
-                                    p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b)].reset_index()[['x','y','z']]
-                                    p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b-1)].reset_index()[['x','y','z']]
-             
-                                    x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                                    
-                                    distance = np.sqrt(min(x_dist,box_size-x_dist)**2
-                                                  + min(y_dist,box_size-y_dist)**2
-                                                  + min(z_dist,box_size-z_dist)**2)
-                                    N += [[data_junctions.at[j,'junction'],distance]]
-                                    break
-                        j = 0
-                        t = True
-                        while t:
-                            for k in range(b+1, length):
-                                while not ([member[0],k] in data_junctions.iloc[j]['members']):
-                                    j += 1
-                                    if j >= len(data_junctions):
-                                        break
-                                if j < len(data_junctions):
-                                    t = False
-                                    p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b)].reset_index()[['x','y','z']]
-                                    p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b+1)].reset_index()[['x','y','z']]
-             
-                                    x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                                    
-                                    distance = np.sqrt(min(x_dist,box_size-x_dist)**2
-                                                  + min(y_dist,box_size-y_dist)**2
-                                                  + min(z_dist,box_size-z_dist)**2)
-                                    N += [[data_junctions.at[j,'junction'],distance]]
-                                    break
-            N.sort()  
-            N1 = list(set([x[0] for x in N]))
-            M = []
-            for elem in N1:
-                N2 = [elm[1] for elm in N if elm[0] == elem]
-                dist = min(N2)
-                strength = len(N2)
-                M += [[elem, dist, strength]]
-            data_junctions.at[i,'neighbors'] = M
-    elif boundary == 'npbc':    
-        for i in range(len(data_junctions)):
-            N = []
-            for member in data_junctions.iloc[i]['members']:
-                K = [[member[0], i] for i in range(length) if i != member[1]]
-                #print('K: {}'.format(K))
-                if all(elem in data_junctions.iloc[i]['members'] for elem in K):
-                    pass
-                else:
-                    if (member[1] == 0):
-                        j = 0
-                        while not ([member[0],1] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == 0)].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == 1)].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-
-                            distance = np.sqrt(x_dist**2
-                                          + y_dist**2
-                                          + z_dist**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-                            #print('Neighbors of {}: {}'.format(i,N))
-                        
-                    elif (member[1] == (length-1)):
-                        j = 0
-                        while not ([member[0],length-2] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == (length-1))].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == (length-2))].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                            
-                            distance = np.sqrt(x_dist**2
-                                          + y_dist**2
-                                          + z_dist**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-                    else:
-                        b = member[1]
-                        j = 0
-                        while not ([member[0],b-1] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b)].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b-1)].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                            
-                            distance = np.sqrt(x_dist**2
-                                          + y_dist**2
-                                          + z_dist**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-                            
-                        j = 0
-                        while not ([member[0],b+1] in data_junctions.iloc[j]['members']):
-                            j += 1
-                            if j >= len(data_junctions):
-                                break
-                        if j < len(data_junctions):
-                            p0 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b)].reset_index()[['x','y','z']]
-                            p1 = data_polymers[(data_polymers['polyIndex'] == member[0]) & (data_polymers['beadPosition'] == b+1)].reset_index()[['x','y','z']]
-     
-                            x_dist, y_dist, z_dist = abs((p0-p1).iloc[0])
-                            
-                            distance = np.sqrt(x_dist**2
-                                          + y_dist**2
-                                          + z_dist**2)
-                            N += [[data_junctions.at[j,'junction'],distance]]
-            N.sort()  
-            N1 = list(set([x[0] for x in N]))
-            M = []
-            for elem in N1:
-                N2 = [elm[1] for elm in N if elm[0] == elem]
-                dist = min(N2)
-                strength = len(N2)
-                M += [[elem, dist, strength]]
-            data_junctions.at[i,'neighbors'] = M
-    else:
+    if boundary not in ['pbc', 'npbc']:
         print('Boundaries of type {} are not understood, please use pbc for'.format(boundary) +
               ' periodic boundaries or npbc for non periodic ones.')
+        return data_junctions
+    
+    length = data_polymers.groupby('polyIndex').count()['beadPosition'].head(1).item()
+    lookup, polymers = junctionLookup(data_junctions, data_polymers)
+    whole = (lookup[:, :length] == lookup[:, :1]).all(axis=1)
+    coordinates = siteCoordinates(data_polymers, polymers, lookup.shape[1])
+    junctions = data_junctions['junction'].to_numpy()
+    mass = data_junctions['members'].apply(len).to_numpy()
+    
+    # bound sites, skipping the polymers lying entirely in one junction
+    bound = (lookup >= 0) & (mass[np.maximum(lookup, 0)] > 1)
+    bound[whole] = False
+    
+    # sweep the bound sites of each polymer in order, every two consecutive
+    # ones are linked
+    rows, sites = np.nonzero(bound)
+    chain = rows[1:] == rows[:-1]
+    rows, first, second = rows[1:][chain], sites[:-1][chain], sites[1:][chain]
+    A = lookup[rows, first]
+    B = lookup[rows, second]
+    D = pairDistance(coordinates[rows, first], coordinates[rows, second],
+                     box_size, boundary)
+    
+    N = [[] for i in range(len(data_junctions))]
+    for a, b, distance in zip(A, B, D):
+        N[a] += [[junctions[b], distance]]
+        N[b] += [[junctions[a], distance]]
+    
+    for i in range(len(data_junctions)):
+        N[i].sort()
+        N1 = list(set([x[0] for x in N[i]]))
+        M = []
+        for elem in N1:
+            N2 = [elm[1] for elm in N[i] if elm[0] == elem]
+            dist = min(N2)
+            strength = len(N2)
+            M += [[elem, dist, strength]]
+        data_junctions.at[i,'neighbors'] = M
+    
     return data_junctions
 
 def neighboursList(data):
@@ -618,50 +499,10 @@ def neighboursList(data):
     return data
 
 
-def connex(data,K,L):
-    """
-    Return the list of members of the connex component containing the elements
-    originaly in L.
-
-    Parameters:
-    -----------
-    data: pandas dataframe
-        data must contain at least one column named neighbors.
-    K: list
-        The list of members of the connex component so far.
-    L: list
-        The starting element, then the list of members of the connex component 
-        reached so far minus the ones that are in K.
-
-    Returns:
-    --------
-    K: list
-        The junctions in the connex component containing the elements
-        originaly in L.
-    """
-    
-    if L == []:
-        K.sort()
-        return K
-    
-    M = []
-    for elem in L:
-        M += data.at[elem,'neighbors_list']
-    
-    N = []
-    for elem2 in M:
-        if not (elem2 in K):
-            N += [elem2]
-            
-    N = list(set(N))
-    L = N
-    K += L
-    return connex(data,K,L)
-
-
 def connexComponents(data):
     """
     Return the same dataframe with a new column labelling the connex components.
+    The components are numbered in the order of their first junction.
 
     Parameters:
     -----------
@@ -674,20 +515,16 @@ def connexComponents(data):
         The input data but with a new column giving the connex components.
     """
     
-    data['component'] = [-1 for i in range(len(data))]
+    n = len(data)
+    lengths = data['neighbors_list'].apply(len).to_numpy(dtype=np.int64)
+    rows = np.repeat(np.arange(n), lengths)
+    cols = np.array([elem for L in data['neighbors_list'] for elem in L], dtype=int)
+    
+    adjacency = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    _, labels = connected_components(adjacency, directed=False)
+    
+    data['component'] = pd.factorize(labels)[0]
     
-    start = 0
-    component = 0
-    while (-1 in data['component'].to_list()):
-        L = connex(data,[start],[start])
-        for elem in L:
-            data.at[elem,'component'] = component
-        try:
-            start = data['component'].to_list().index(-1)
-        except ValueError:
-            pass
-        component += 1
-        
     return data
 
 
@@ -712,6 +549,32 @@ def smallJunctions(data):
     return data
 
 
+def junctionAdjacency(data):
+    """
+    Return the adjacency matrix of the junctions, weighted by the strength of
+    the links.
+
+    Parameters:
+    -----------
+    data: pandas dataframe
+        data must contain at least one column named neighbors.   
+
+    Returns:
+    --------
+    A: scipy sparse matrix
+        A[i, j] is the number of links between the junctions i and j, in
+        compressed sparse row form.
+    """
+    
+    n = len(data)
+    lengths = data['neighbors'].apply(len).to_numpy()
+    rows = np.repeat(np.arange(n), lengths)
+    cols = np.array([elem[0] for M in data['neighbors'] for elem in M], dtype=int)
+    strength = np.array([elem[2] for M in data['neighbors'] for elem in M], dtype=np.int64)
+    
+    return csr_matrix((strength, (rows, cols)), shape=(n, n))
+
+
 def bridges(data):
     """
     Return the same dataframe containing a boolean for each junction labelling 
@@ -729,20 +592,18 @@ def bridges(data):
         bridge or not.
     """
     
-    B = []
-    for i in range(len(data)):
-        if data.iloc[i]['mass'] == 2:
-            test = [True,True]
-            L = data.iloc[i]['neighbors_list']
-            try:
-                for i in range(2):
-                    if data.iloc[L[i]]['mass'] < 2:
-                        test[i] = False
-                B += [test[0]*test[1]]
-            except IndexError:
-                B += [0]
-        else:
-            B += [0]
+    mass = data['mass'].to_numpy()
+    lengths = data['neighbors_list'].apply(len).to_numpy(dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    flat = np.array([elem for L in data['neighbors_list'] for elem in L], dtype=int)
+    
+    # the two first neighbors of the junctions of mass 2 are tested at once
+    candidates = (mass == 2) & (lengths >= 2)
+    first = flat[starts[candidates]]
+    second = flat[starts[candidates] + 1]
+    
+    B = np.zeros(len(data), dtype=np.int64)
+    B[candidates] = (mass[first] >= 2) & (mass[second] >= 2)
     data['bridge'] = B
     return data
 
@@ -764,42 +625,23 @@ def degree(data):
         of each junction.
     """
     
-    degreeG = []
-    degreeMG = []
-    
-    for i in range(len(data)):
-        A = data.iloc[i][['small_junction','bridge']].to_list()
-        if A == [1,0]:
-            degreeG += [0]
-            degreeMG += [0]
-        elif A == [1,1]:
-            degreeG += [2]
-            degreeMG += [2]
-        else:
-            L = data.iloc[i]['neighbors_list']
-            degG = 0
-            degMG = 0
-            for neighbor in L:
-                if data.iloc[neighbor][['small_junction','bridge']].to_list() == [1,0]:
-                    degG += 0
-                    degMG += 0
-                elif data.iloc[neighbor][['small_junction','bridge']].to_list() == [1,1]:
-                    degG += 1
-                    degMG += 1
-                else:
-                    degG += 1
-                    M = data.iloc[i]['neighbors']
-                    n = len(M)
-                    j = 0
-                    t = False
-                    while ((j < n) and not t):
-                        if M[j][0] == neighbor:
-                            degMG += M[j][2]
-                            t = True
-                        else:
-                            j += 1
-            degreeG += [degG]
-            degreeMG += [degMG]
+    small = data['small_junction'].to_numpy() == 1
+    bridge = data['bridge'].to_numpy() == 1
+    lone = small & ~bridge
+    
+    A = junctionAdjacency(data)
+    P = A.copy()
+    P.data[:] = 1
+    
+    # a small junction counts for nothing, a bridge for one link and the
+    # other junctions for the strength of their links
+    degreeG = P @ (~lone).astype(np.int64)
+    degreeMG = P @ (small & bridge).astype(np.int64) + A @ (~small).astype(np.int64)
+    
+    degreeG[lone] = 0
+    degreeMG[lone] = 0
+    degreeG[small & bridge] = 2
+    degreeMG[small & bridge] = 2
     
     data['degreeG'] = degreeG
     data['degreeMG'] = degreeMG
@@ -807,13 +649,43 @@ def degree(data):
     return data
         
 
-
 # =============================================================================
 ## Main function
 # =============================================================================
 
 
-def mainClustering(dir_in, dir_out, name, box_size = 48, boundary = 'pbc'):
+def junctionFrame(data, box_size = 48, boundary = 'pbc', nearest = None):
+    """
+    Do the clustering, linksLinear, neighbours_list, connex_components, 
+    small_junctions, bridges and degree functions for one frame.
+
+    Parameters:
+    -----------
+    data: pandas dataframe
+        The binding sites, with their neighbours in a nearest column unless
+        nearest is given.
+    nearest: tuple of numpy arrays, default None
+        The neighbours in CSR form, see clustering.
+
+    Returns:
+    --------
+    data2: pandas dataframe
+        The junctions of the frame.
+    """
+    
+    data2 = clustering(data, nearest=nearest)
+    linksLinear(data2, data, boundary, box_size)
+    neighboursList(data2)
+    connexComponents(data2)
+    smallJunctions(data2)
+    bridges(data2)
+    degree(data2)
+    
+    return data2
+
+
+def mainClustering(dir_in, dir_out, name, box_size = 48, boundary = 'pbc', fmt = 'pkl',
+                   cache = None, cache_size = None):
     """
     Do the clustering, linksLinear, neighbours_list, connex_components, 
     small_junctions, bridges and degree functions for a bunch of file and save
@@ -828,6 +700,16 @@ def mainClustering(dir_in, dir_out, name, box_size = 48, boundary = 'pbc'):
         will save the {name} subdirectory.
     name: string
         Subdirectory in the input directory where the files lie.
+    fmt: 'pkl' or 'frame', default 'pkl'
+        Format of the saved files, see storage.saveFrame. The input files
+        can be in either format.
+    cache: string, default None
+        Cache directory. If given, the outputs of each file are cached under
+        the hash of the file (and of its CSR neighbours) and the parameters
+        (box_size, boundary and fmt), see cache.py.
+    cache_size: int, default None
+        Size limit of the cache in bytes, no limit if None. The least recently
+        used entries are evicted once all the files are done.
 
     Returns:
     --------
@@ -840,40 +722,123 @@ def mainClustering(dir_in, dir_out, name, box_size = 48, boundary = 'pbc'):
     save_path = dir_path.parent.joinpath(dir_out,name)
     save_path.mkdir(parents=True, exist_ok=True)
     
-    # work on each files
-    onlyfiles = [f for f in os.listdir(path) if isfile(join(path, f))]
+    cache_path = None if cache is None else dir_path.parent.joinpath(cache)
     
-    file_list = []
-    for filename in onlyfiles:
-        if filename.endswith('.pkl'):
-            file_list.append(filename)
-    file_list.sort()
+    # work on each files
+    file_list = listFrames(path)
     n = len(file_list)
     
     for i in range(n):
         print("{} file {:02d} / {}".format(name, i+1, n))
-        file_path = os.path.join(path,file_list[i])
-        df0 = pd.read_pickle(file_path)
-        df1 = clustering(df0)
-        linksLinear(df1, df0, boundary, box_size)
-        neighboursList(df1)
-        connexComponents(df1)
-        smallJunctions(df1)
-        bridges(df1)
-        degree(df1)
-        
-        save_name = save_path.joinpath(file_list[i])
-        df1.to_pickle(save_name)
+        clusteringFile(path.joinpath(file_list[i]), save_path, box_size, boundary,
+                       fmt, cache_path)
+    
+    if (cache_path is not None) and (cache_size is not None):
+        cacheEvict(cache_path, cache_size)
+
+
+def clusteringFile(file_path, save_path, box_size = 48, boundary = 'pbc', fmt = 'pkl',
+                   cache_path = None):
+    """
+    Do the junctionFrame function for one file and save the result, see
+    mainClustering.
+
+    Parameters:
+    -----------
+    file_path: Path
+        The frame, with its neighbours in the nearest column or in CSR form
+        in a .npz file beside it.
+    save_path: Path
+        Directory where the result is saved under the name of the frame.
+    cache_path: Path, default None
+        Cache directory, see mainClustering.
+
+    Returns:
+    --------
+    Nothing directly. The result is saved in save_path.
+    """
+    
+    save_name = save_path.joinpath(frameStem(file_path.name))
+    # neighbours saved beside the frame in CSR form by mainNeighbors
+    csr_path = file_path.with_name(frameStem(file_path.name) + '.npz')
+    if cache_path is not None:
+        key = cacheKey([file_path, csr_path], 'clustering',
+                       {'box_size': box_size, 'boundary': boundary, 'fmt': fmt})
+        if cacheLoad(cache_path, key, save_name):
+            return
+    
+    df0 = loadFrame(file_path)
+    if isfile(csr_path):
+        df1 = junctionFrame(df0, box_size, boundary, nearest=loadCSR(csr_path))
+    else:
+        df1 = junctionFrame(df0, box_size, boundary)
+    saveFrame(df1, save_name, fmt)
+    
+    if cache_path is not None:
+        cacheStore(cache_path, key, save_name, [FORMATS[fmt]])
+
+
+def batchClustering(dir_in, dir_out, names, box_size = 48, boundary = 'pbc', fmt = 'pkl',
+                    workers = 1, cache = None, cache_size = None):
+    """
+    Do mainClustering for the files of several runs at once, in parallel. The
+    finished files are recorded in the manifest .clustering_manifest.jsonl of
+    the output directory, so a batch stopped at any point resumes where it
+    stopped, see executor.runTasks. A file that fails does not stop the batch.
+
+    Parameters:
+    -----------
+    dir_in: string
+        Input directory, where the script will search the directories named
+        in names.
+    dir_out: string
+        Output directory, that the script will eventually create and where it 
+        will save the {name} subdirectories.
+    names: list of strings
+        Subdirectories in the input directory where the files lie.
+    workers: int, default 1
+        Number of files processed in parallel.
+    box_size, boundary, fmt, cache, cache_size:
+        See mainClustering.
 
+    Returns:
+    --------
+    records: list of dicts
+        The record of each file processed, with its duration and error, see
+        executor.runTasks.
+    """
+    
+    dir_path = Path(os.getcwd()) 
+    out_path = dir_path.parent.joinpath(dir_out)
+    out_path.mkdir(parents=True, exist_ok=True)
+    cache_path = None if cache is None else dir_path.parent.joinpath(cache)
+    
+    tasks = {}
+    for name in names:
+        path = dir_path.parent.joinpath(dir_in,name)
+        save_path = out_path.joinpath(name)
+        save_path.mkdir(parents=True, exist_ok=True)
+        for file in listFrames(path):
+            tasks[name + '/' + file] = (path.joinpath(file), save_path, box_size, boundary,
+                                        fmt, cache_path)
+    
+    params = {'dir_in': str(dir_in), 'box_size': box_size, 'boundary': boundary, 'fmt': fmt}
+    records = runTasks(clusteringFile, tasks, out_path.joinpath('.clustering_manifest.jsonl'),
+                       params, workers)
+    
+    # the workers only store, the cache is trimmed once for the whole batch
+    if (cache_path is not None) and (cache_size is not None):
+        cacheEvict(cache_path, cache_size)
+    return records
 
 
-L = ['6d48', '6e48', '6f48']
-M = ['6e48', '6f48']
 
-for elem in L:
-    mainClustering('neo_KNN/65', 'neo_junctions/65', elem)
-for elem in M:
-    mainClustering('neo_KNN/4', 'neo_junctions/4', elem)
+if __name__ == '__main__':
+    L = ['6d48', '6e48', '6f48']
+    M = ['6e48', '6f48']
+    
+    batchClustering('neo_KNN/65', 'neo_junctions/65', L, workers=os.cpu_count())
+    batchClustering('neo_KNN/4', 'neo_junctions/4', M, workers=os.cpu_count())
 
 
 
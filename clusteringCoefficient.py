@@ -11,7 +11,10 @@ Created on Mon Dec  6 14:15:17 2021
 # =============================================================================
 
 import numpy as np
-import networkx as nx
+import pandas as pd
+
+# networkx is imported by the functions using graphs, when used
+from scipy.sparse import csr_matrix, coo_matrix, block_diag
 
 # =============================================================================
 ## Basic functions
@@ -36,28 +39,20 @@ def multigraphClustering(G):
         the graph G.
     """
     
-    A = nx.adjacency_matrix(G)
-    A = A.todense()
-    n = A.shape[0]
-    C = []
+    import networkx as nx
+    
+    A = csr_matrix(nx.adjacency_matrix(G))
     
-    p = 0
-    for i in range(n):
-        for j in range(n):
-            p += A[i,j]
+    A.setdiag(0)
+    A.eliminate_zeros()
     
-    for i in range(n):
-        A[i,i] = 0
+    # the diagonal of A.A.A, without the dense product
+    T = np.asarray((A @ A).multiply(A).sum(axis=1)).ravel()
+    k = A.getnnz(axis=1)
     
-    T = np.matmul(np.matmul(A,A),A)
-    for i in range(n):
-        C_i = T[i,i]
-        k_i = sum([min(A[i,j],1) for j in range(n)])
-          
-        C_i /= max((k_i-1)*(k_i),1)
-        C += [C_i]
+    C = T / np.maximum((k-1)*k, 1)
     
-    return C
+    return list(C)
 
 
 def unweightedCC(data_edges):
@@ -77,6 +72,8 @@ def unweightedCC(data_edges):
         Average clustering coefficient of G.
     """
     
+    import networkx as nx
+    
     G = nx.from_pandas_edgelist(data_edges, 'source', 'target', create_using=nx.Graph())
     avgUWCC = nx.average_clustering(G)
     
@@ -100,8 +97,104 @@ def weightedCC(data_edges):
         Average multigrah clustering coefficient of G.
     """
     
+    import networkx as nx
+    
     G = nx.from_pandas_edgelist(data_edges, 'source', 'target', create_using=nx.MultiGraph())
     M = multigraphClustering(G)
     avgWCC = sum(M)/max(len(M),1)
 
-    return G, avgWCC
\ No newline at end of file
+    return G, avgWCC
+
+# =============================================================================
+## Batch functions
+# =============================================================================
+
+
+def linkMatrix(data_edges):
+    """
+    Return the nodes of a graph and its matrix of links, without networkx.
+
+    Parameters:
+    -----------
+    data_edges: pandas dataframe
+        data must contain three columns named source, target and links, with
+        one row per edge (see utilitaries.toEdgeList).
+
+    Returns:
+    --------
+    nodes: numpy array
+        The nodes, in the order networkx would add them.
+    W: scipy csr matrix
+        The symmetric matrix of the number of links between the nodes, with a
+        zero diagonal (the loops are not counted).
+    """
+    
+    source = data_edges['source'].to_numpy()
+    target = data_edges['target'].to_numpy()
+    links = data_edges['links'].to_numpy()
+    
+    # nodes numbered by first appearance, source before target on each row
+    codes, nodes = pd.factorize(np.column_stack([source, target]).ravel())
+    i, j = codes[0::2], codes[1::2]
+    n = len(nodes)
+    
+    off = i != j
+    W = coo_matrix((np.concatenate([links[off], links[off]]),
+                    (np.concatenate([i[off], j[off]]), np.concatenate([j[off], i[off]]))),
+                   shape=(n, n)).tocsr()
+    
+    return nodes, W
+
+
+def batchCC(edge_lists):
+    """
+    Return the average clustering coefficient and the average multigraph
+    clustering coefficient of many graphs at once. The graphs are put in a
+    single block diagonal matrix, so the triangles of every graph are counted
+    with one sparse product.
+    
+    The values are the same as the ones of unweightedCC (networkx average
+    clustering, loops ignored) and weightedCC (see multigraphClustering), the
+    average of a graph without nodes is 0.
+
+    Parameters:
+    -----------
+    edge_lists: list of pandas dataframes
+        The edges of each graph, with one row per edge and three columns named
+        source, target and links (see utilitaries.toEdgeList).
+
+    Returns:
+    --------
+    df: pandas dataframe
+        One row per graph with the columns nodes, edges (loops included),
+        links, avgCC and avgWCC.
+    """
+    
+    blocks = [linkMatrix(data_edges)[1] for data_edges in edge_lists]
+    sizes = [W.shape[0] for W in blocks]
+    W = block_diag(blocks, format='csr') if blocks else csr_matrix((0, 0), dtype=np.int64)
+    
+    B = W.copy()
+    B.data[:] = 1
+    k = B.getnnz(axis=1)
+    
+    # the diagonal of B.B.B and W.W.W
+    T = np.asarray((B @ B).multiply(B).sum(axis=1)).ravel()
+    TW = np.asarray((W @ W).multiply(W).sum(axis=1)).ravel()
+    
+    CC = np.zeros(len(k))
+    np.divide(T, k*(k-1), out=CC, where=T > 0)
+    WCC = TW / np.maximum((k-1)*k, 1)
+    
+    L = []
+    start = 0
+    for data_edges, n in zip(edge_lists, sizes):
+        # summed in node order like networkx, for the same rounding
+        avgCC = sum(CC[start:start+n].tolist())/max(n,1)
+        avgWCC = sum(WCC[start:start+n].tolist())/max(n,1)
+        L += [[n, len(data_edges), int(data_edges['links'].sum()), avgCC, avgWCC]]
+        start += n
+    
+    df = pd.DataFrame(L, columns=['nodes', 'edges', 'links', 'avgCC', 'avgWCC'])
+    
+    return df
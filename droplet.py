@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line interface of the droplet analysis.
+"""
+
+# =============================================================================
+## Library dependancies
+# =============================================================================
+
+import os
+import sys
+import argparse
+from pathlib import Path
+
+"""
+Command line entry point of the stages:
+
+    python droplet.py clean dir_in dir_out
+    python droplet.py neighbors dir_in dir_out name [name ...]
+    python droplet.py cluster dir_in dir_out name [name ...]
+    python droplet.py pipeline dir_in dir_out name [name ...]
+    python droplet.py pack dir_in name [name ...]
+    python droplet.py fluidity dir_in dir_out save_name
+    python droplet.py plot kind dir_in name [name ...]
+
+The directories are given relative to the parent of the working directory,
+like in the main functions of each stage. Each command only imports the
+modules it uses, matplotlib and seaborn are only imported by plot. pack saves
+the frames of each run dir_in/name in a container dir_in/name.run, which is
+read instead of the directory as long as it is up to date (see
+storage.currentRun).
+"""
+
+# =============================================================================
+## Commands
+# =============================================================================
+
+
+def runClean(args):
+    from clean import main_clean
+    main_clean(args.dir_in, args.dir_out, args.boundary, args.fmt, args.workers, args.force)
+
+
+def runNeighbors(args):
+    from neighborsSearch import mainNeighbors
+    for name in args.names:
+        mainNeighbors(args.dir_in, args.dir_out, name, args.radius, args.box_size,
+                      args.boundary, args.method, args.chunk_size, args.layout, args.skin,
+                      args.workers, args.fmt, args.cache, args.cache_size)
+
+
+def runCluster(args):
+    from clustering import batchClustering
+    records = batchClustering(args.dir_in, args.dir_out, args.names, args.box_size,
+                              args.boundary, args.fmt, args.workers, args.cache,
+                              args.cache_size)
+    if any(record['status'] == 'failed' for record in records):
+        sys.exit(1)
+
+
+def runPipeline(args):
+    from pipeline import mainPipeline
+    checkpoints = {}
+    if args.clean_dir is not None:
+        checkpoints['clean'] = args.clean_dir
+    if args.neighbors_dir is not None:
+        checkpoints['neighbors'] = args.neighbors_dir
+    for name in args.names:
+        mainPipeline(args.dir_in, args.dir_out, name, args.radius, args.box_size,
+                     args.boundary, args.method, args.chunk_size, args.skin, args.workers,
+                     args.fmt, checkpoints)
+
+
+def runPack(args):
+    from storage import packFrames
+    path = Path(os.getcwd()).parent.joinpath(args.dir_in)
+    for name in args.names:
+        print("{} -> {}".format(name, packFrames(path.joinpath(name)).name))
+
+
+def runFluidity(args):
+    from fluidity import mainFluidity
+    mainFluidity(args.dir_in, args.dir_out, args.save_name, args.max_offset, args.max_step)
+
+
+def runPlot(args):
+    import matplotlib
+    if args.output is not None:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import graphs
+    
+    if args.kind == 'mass':
+        graphs.graphMass(args.dir_in, args.names, not args.no_loop, args.sj)
+    elif args.kind == 'degree':
+        graphs.graphDegree(args.dir_in, args.names, not args.simple, args.sj)
+    elif args.kind == 'clustering':
+        graphs.graphClustering(args.dir_in, args.names, not args.weighted, args.sj,
+                               null_cache=args.null_cache)
+    elif args.kind == 'comparison':
+        graphs.graphClusteringComparison(args.dir_in, args.names, args.sj,
+                                         null_cache=args.null_cache)
+    else:
+        graphs.graphFluidity(args.dir_in, args.names[0])
+    
+    if args.output is not None:
+        plt.savefig(args.output, bbox_inches='tight')
+    else:
+        plt.show()
+
+
+# =============================================================================
+## Arguments
+# =============================================================================
+
+
+def parser():
+    """
+    Return the parser of the command line, see the module documentation.
+    """
+    
+    main = argparse.ArgumentParser(prog='droplet',
+                                   description='Junction networks of polymer droplets.')
+    commands = main.add_subparsers(dest='command', required=True)
+    
+    # shared arguments
+    box = argparse.ArgumentParser(add_help=False)
+    box.add_argument('--box-size', type=int, default=48, help='size of the simulation box')
+    box.add_argument('--boundary', choices=['pbc', 'npbc'], default='pbc')
+    box.add_argument('--fmt', choices=['pkl', 'frame'], default='pkl',
+                     help='format of the saved files')
+    box.add_argument('--workers', type=int, default=1, help='number of processes')
+    
+    search = argparse.ArgumentParser(add_help=False)
+    search.add_argument('--radius', type=float, default=1.5, help='search radius')
+    search.add_argument('--method', choices=['brute', 'cell'], default='cell')
+    search.add_argument('--chunk-size', type=int, default=1024)
+    search.add_argument('--skin', type=float, default=None, help='Verlet list skin')
+    
+    cache = argparse.ArgumentParser(add_help=False)
+    cache.add_argument('--cache', default=None, help='cache directory')
+    cache.add_argument('--cache-size', type=int, default=None, help='cache size limit in bytes')
+    
+    command = commands.add_parser('clean', parents=[box], help='clean the raw .rst files')
+    command.add_argument('dir_in')
+    command.add_argument('dir_out')
+    command.add_argument('--force', action='store_true', help='clean up to date files again')
+    command.set_defaults(run=runClean)
+    
+    command = commands.add_parser('neighbors', parents=[box, search, cache],
+                                  help='search the neighbours of the binding sites')
+    command.add_argument('dir_in')
+    command.add_argument('dir_out')
+    command.add_argument('names', nargs='+', help='runs in dir_in')
+    command.add_argument('--layout', choices=['list', 'csr'], default='list')
+    command.set_defaults(run=runNeighbors)
+    
+    command = commands.add_parser('cluster', parents=[box, cache],
+                                  help='build the junctions (resumable batch)')
+    command.add_argument('dir_in')
+    command.add_argument('dir_out')
+    command.add_argument('names', nargs='+', help='runs in dir_in')
+    command.set_defaults(run=runCluster)
+    
+    command = commands.add_parser('pipeline', parents=[box, search],
+                                  help='from the raw .rst files to the junctions')
+    command.add_argument('dir_in')
+    command.add_argument('dir_out')
+    command.add_argument('names', nargs='+', help='runs in dir_in')
+    command.add_argument('--clean-dir', default=None, help='checkpoint of the clean stage')
+    command.add_argument('--neighbors-dir', default=None, help='checkpoint of the neighbours')
+    command.set_defaults(run=runPipeline)
+    
+    command = commands.add_parser('pack', help='pack the frames of runs in .run containers')
+    command.add_argument('dir_in')
+    command.add_argument('names', nargs='+', help='runs in dir_in')
+    command.set_defaults(run=runPack)
+    
+    command = commands.add_parser('fluidity', help='fluidity of the junctions of every run')
+    command.add_argument('dir_in')
+    command.add_argument('dir_out')
+    command.add_argument('save_name')
+    command.add_argument('--max-offset', type=int, default=10)
+    command.add_argument('--max-step', type=int, default=6)
+    command.set_defaults(run=runFluidity)
+    
+    command = commands.add_parser('plot', help='plot the networks of some runs')
+    command.add_argument('kind', choices=['mass', 'degree', 'clustering', 'comparison',
+                                          'fluidity'])
+    command.add_argument('dir_in')
+    command.add_argument('names', nargs='+',
+                         help='runs in dir_in (the fluidity file for fluidity)')
+    command.add_argument('--sj', action='store_true', help='include the small junctions')
+    command.add_argument('--no-loop', action='store_true', help='mass without the loops')
+    command.add_argument('--simple', action='store_true', help='degree instead of multidegree')
+    command.add_argument('--weighted', action='store_true', help='weighted clustering')
+    command.add_argument('--null-cache', default='null_models',
+                         help='directory where the small-world ensembles are saved')
+    command.add_argument('--no-null-cache', dest='null_cache', action='store_const',
+                         const=None, help='do not save the small-world ensembles')
+    command.add_argument('--output', default=None, help='save the figure instead of showing it')
+    command.set_defaults(run=runPlot)
+    
+    return main
+
+
+def main(argv = None):
+    args = parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Resumable process pool for the batches of tasks.
+"""
+
+# =============================================================================
+## Library dependancies
+# =============================================================================
+
+import os
+import json
+import time
+import traceback
+from os.path import isfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# =============================================================================
+## Resumable executor
+# =============================================================================
+
+"""
+The tasks of a batch are run in a process pool and each finished task is
+appended to a manifest, one json line per task with its status ('done' or
+'failed'), its duration and the error of a failed task. When the batch is run
+again with the same manifest, the tasks already done with the same
+parameters are skipped, so a batch stopped at any point resumes where it
+stopped. A failed task does not stop the batch, it is run again next time,
+and neither does a worker process that dies.
+"""
+
+
+def timedTask(function, args):
+    """
+    Run a task and return its duration and error, see runTasks.
+
+    Parameters:
+    -----------
+    function: function
+        The function of the task.
+    args: tuple
+        Its arguments.
+
+    Returns:
+    --------
+    elapsed, error: float, string
+        The duration in seconds and the traceback of the error (None if the
+        task succeeded).
+    """
+    
+    start = time.perf_counter()
+    try:
+        function(*args)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return time.perf_counter() - start, error
+
+
+def readManifest(manifest_path):
+    """
+    Return the last record of each task of a manifest.
+
+    Parameters:
+    -----------
+    manifest_path: string or Path
+        The manifest, a json lines file.
+
+    Returns:
+    --------
+    records: dict
+        The last record of each task, by task name.
+    """
+    
+    records = {}
+    if isfile(manifest_path):
+        with open(manifest_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # line cut by a crash while it was written
+                    continue
+                records[record['task']] = record
+    return records
+
+
+def taskResults(function, tasks, todo, workers = 1):
+    """
+    Run the tasks of todo, in this process if workers is 1 and in a process
+    pool otherwise, see runTasks.
+
+    Parameters:
+    -----------
+    function: function
+        The function run for each task.
+    tasks: dict
+        The arguments (tuple) of each task, by task name.
+    todo: list of strings
+        The names of the tasks to run.
+    workers: int, default 1
+        Number of processes.
+
+    Returns:
+    --------
+    results: generator of tuples
+        The name of each task and its duration and error (see timedTask), as
+        they finish. If a worker dies, its task and the tasks left in the pool
+        are failed, with the time until the failure was seen.
+    """
+    
+    if workers == 1:
+        for task in todo:
+            yield task, timedTask(function, tasks[task])
+        return
+    if not todo:
+        return
+    
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(timedTask, function, tasks[task]): task for task in todo}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception:
+                # the worker died (BrokenProcessPool), then every task left
+                # in the pool fails the same way and is recorded here
+                result = time.perf_counter() - start, traceback.format_exc()
+            yield futures[future], result
+
+
+def runTasks(function, tasks, manifest_path, params = None, workers = 1):
+    """
+    Run function on each task in a process pool (in this process if workers
+    is 1), skipping the tasks already done according to the manifest.
+
+    Parameters:
+    -----------
+    function: function
+        The function run for each task, it must be defined at the top level of
+        a module.
+    tasks: dict
+        The arguments (tuple) of each task, by task name.
+    manifest_path: string or Path
+        The manifest recording the finished tasks.
+    params: dict, default None
+        The parameters shared by the tasks, a task done with other parameters
+        is run again.
+    workers: int, default 1
+        Number of processes.
+
+    Returns:
+    --------
+    records: list of dicts
+        The record of each task run (task, status, time, error, params). If a
+        worker dies, its task and the tasks left in the pool are failed, with
+        the time until the failure was seen.
+    """
+    
+    done = readManifest(manifest_path)
+    todo = [task for task in tasks
+            if not ((task in done) and (done[task]['status'] == 'done')
+                    and (done[task].get('params') == params))]
+    n = len(todo)
+    print("{} / {} tasks to run".format(n, len(tasks)))
+    
+    records = []
+    with open(manifest_path, 'a') as manifest:
+        for k, (task, (elapsed, error)) in enumerate(taskResults(function, tasks, todo, workers)):
+            record = {'task': task, 'status': 'done' if error is None else 'failed',
+                      'time': elapsed, 'error': error, 'params': params}
+            manifest.write(json.dumps(record) + '\n')
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            records += [record]
+            print("task {:02d} / {}: {} {} in {:.2f} s".format(k+1, n, task, record['status'], elapsed))
+    
+    report(records)
+    return records
+
+
+def report(records):
+    """
+    Print the number of tasks done and failed, their total and longest
+    duration, and the errors.
+
+    Parameters:
+    -----------
+    records: list of dicts
+        The records returned by runTasks.
+
+    Returns:
+    --------
+    Nothing directly.
+    """
+    
+    failed = [record for record in records if record['status'] == 'failed']
+    total = sum(record['time'] for record in records)
+    print("{} tasks done, {} failed, {:.2f} s in total".format(len(records) - len(failed),
+                                                             len(failed), total))
+    if records:
+        slowest = max(records, key=lambda record: record['time'])
+        print("longest task: {} ({:.2f} s)".format(slowest['task'], slowest['time']))
+    for record in failed:
+        print("task {} failed:\n{}".format(record['task'], record['error']))
@@ -12,11 +12,9 @@ Created on Mon Dec  6 11:26:20 2021
 
 import pandas as pd
 import os
-import seaborn as sns
 from pathlib import Path
-from os.path import isfile, isdir, join
 
-from utilitaries import dfListConnex
+from storage import listRuns, readRun
 
 # =============================================================================
 ## Basic functions
@@ -131,6 +129,41 @@ def children(data_list, max_step = 6):
 #     return df
 
 
+def offsetFluidity(data_list, offset, max_step):
+    """
+    Return a dataframe containing the children of each node of the first
+    dataframe of data_list for all steps in max_step, and their fluidity.
+
+    Parameters:
+    -----------
+    data_list: list of pandas dataframe
+        Each element in data_list must contain at least three columns named 
+        members, mass and small_junction. Only the max_step + 1 first ones
+        are used.
+    offset: integer
+        Position of the first dataframe in the run, it gives the time.
+    max_steps: interger
+        Number of time steps the children search will de done.
+
+    Returns:
+    --------
+    data: pandas dataframe
+        A new dataframe with the weight, the step, the children, children 
+        number and fluidity for each cluster and each time step.
+    """
+    
+    data = children(data_list, max_step)
+    # Add the starting time to teh dataframe
+    data['time'] = [int(50000*(offset+1)) for j in range(len(data))]
+    K = []
+    # Add the fluidity measure to each junction
+    for i in range(len(data)):
+        K += [(data.at[i,'children_number'] - 1)/ data.at[i,'mass']]
+    data['fluidity'] = K
+    
+    return data
+
+
 def fluidity(data_list, max_offset, max_step):
     """
     Return a dataframe containing the children of each node for all steps 
@@ -157,15 +190,44 @@ def fluidity(data_list, max_offset, max_step):
     dfluidity = []
     
     for offset in range(max_offset):
-        data = children(data_list[offset:], max_step)
-        # Add the starting time to teh dataframe
-        data['time'] = [int(50000*(offset+1)) for j in range(len(data))]
-        K = []
-        # Add the fluidity measure to each junction
-        for i in range(len(data)):
-            K += [(data.at[i,'children_number'] - 1)/ data.at[i,'mass']]
-        data['fluidity'] = K
-        dfluidity += [data]
+        dfluidity += [offsetFluidity(data_list[offset:], offset, max_step)]
+    
+    df = pd.concat(dfluidity, ignore_index=True)
+    return df
+
+
+def runFluidity(path, max_offset, max_step):
+    """
+    Return the same dataframe as fluidity for the frames of a run, reading
+    only the max_step + 1 frames needed for each starting frame (see
+    storage.readRun). Each frame is read once.
+
+    Parameters:
+    -----------
+    path: string or Path
+        The run, a directory or a run container without its .run suffix.
+    max_offset: integer
+        Until which frame of the run does the function make the children 
+        search?
+    max_steps: interger
+        Number of time steps the children search will de done.
+
+    Returns:
+    --------
+    df: pandas dataframe
+        See fluidity.
+    """
+    
+    columns = ['members', 'mass', 'small_junction']
+    
+    dfluidity = []
+    window = readRun(path, 0, max_step + 1, columns)
+    
+    for offset in range(max_offset):
+        if offset > 0:
+            # slide the window by one frame
+            window = window[1:] + readRun(path, offset + max_step, offset + max_step + 1, columns)
+        dfluidity += [offsetFluidity(window, offset, max_step)]
     
     df = pd.concat(dfluidity, ignore_index=True)
     return df
@@ -184,7 +246,8 @@ def mainFluidity(dir_in, dir_out, save_name, max_offset, max_step):
     Parameters:
     -----------
     dir_in: string
-        Input directory, where the script will search take all the subdirectories.
+        Input directory, where the script will search take all the subdirectories
+        and run containers (see storage.listRuns).
     dir_out: string
         Output directory, that the script will eventually create and where it 
         will save the outputed dataframe.
@@ -209,29 +272,15 @@ def mainFluidity(dir_in, dir_out, save_name, max_offset, max_step):
     
     dfluidity = []
     
-    onlydirs = [d for d in os.listdir(path) if isdir(join(path, d))]
+    onlydirs = listRuns(path)
     n = len(onlydirs)
     count = 1
     
     for name in onlydirs:
         print("file {:02d} / {}".format(count,n))
-        subpath = path.joinpath(name)
-        # work on each files
-        onlyfiles = [f for f in os.listdir(subpath) if isfile(join(subpath, f))]
-        
-        file_list = []
-        for filename in onlyfiles:
-            if filename.endswith('.pkl'):
-                file_list.append(filename)
-        file_list.sort()
-
-        df_list = []
-        for i in range(len(file_list)):
-            
-            file_path = os.path.join(subpath,file_list[i])
-            df_list += [pd.read_pickle(file_path)]
-        
-        df1 = fluidity(df_list, max_offset, max_step)
+        # work on the frames of each window, from the run container if
+        # it is up to date
+        df1 = runFluidity(path.joinpath(name), max_offset, max_step)
         df1['run'] = [name] * len(df1)
         #df1['affinity'] = [df_list.iloc[0]['affinity']] * len(df1)
         dfluidity += [df1]
@@ -12,44 +12,44 @@ Created on Fri Dec  3 09:04:55 2021
 
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import networkx as nx
 import os
-import matplotlib.pyplot as plt
-import mpl_toolkits.mplot3d.axes3d as p3
 
-from mpl_toolkits.mplot3d import proj3d
-from matplotlib.patches import FancyArrowPatch
+# seaborn and matplotlib are imported by the plotting functions, when used
 from pathlib import Path
 from utilitaries import toEdgeList, dfListConnex, includeSJ
-from clusteringCoefficient import unweightedCC, weightedCC
+from clusteringCoefficient import batchCC
+from nullModels import smallWorldCC
 
 
 # =============================================================================
 ## Graphical functions
 # =============================================================================
 
-###############################################################################
-
-class Arrow3D(FancyArrowPatch):
-    def __init__(self, xs, ys, zs, *args, **kwargs):
-        FancyArrowPatch.__init__(self, (0,0), (0,0), *args, **kwargs)
-        self._verts3d = xs, ys, zs
-
-    def draw(self, renderer):
-        xs3d, ys3d, zs3d = self._verts3d
-        xs, ys, zs = proj3d.proj_transform(xs3d, ys3d, zs3d, renderer.M)
-        self.set_positions((xs[0],ys[0]),(xs[1],ys[1]))
-        FancyArrowPatch.draw(self, renderer)
-
-###############################################################################
-
-
 def network3D(dir_in,name, step):
     """
     A retester
     """
     
+    import matplotlib.pyplot as plt
+    import mpl_toolkits.mplot3d.axes3d as p3
+    from mpl_toolkits.mplot3d import proj3d
+    from matplotlib.patches import FancyArrowPatch
+    
+    ###########################################################################
+    
+    class Arrow3D(FancyArrowPatch):
+        def __init__(self, xs, ys, zs, *args, **kwargs):
+            FancyArrowPatch.__init__(self, (0,0), (0,0), *args, **kwargs)
+            self._verts3d = xs, ys, zs
+    
+        def draw(self, renderer):
+            xs3d, ys3d, zs3d = self._verts3d
+            xs, ys, zs = proj3d.proj_transform(xs3d, ys3d, zs3d, renderer.M)
+            self.set_positions((xs[0],ys[0]),(xs[1],ys[1]))
+            FancyArrowPatch.draw(self, renderer)
+    
+    ###########################################################################
+    
     df_lst = dfListConnex(dir_in,name)
     k = step
 
@@ -114,6 +114,9 @@ def graphMass(dir_in, lst, loop = True, SJ = False):
         network.
     """
     
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    
     L = []
     for elem in lst:
         data_list = dfListConnex(dir_in, elem)
@@ -178,6 +181,9 @@ def graphDegree(dir_in, lst, multi = True, SJ = False):
         junctions in the network.
     """
     
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    
     
     L = []
     for elem in lst:
@@ -220,7 +226,38 @@ def graphDegree(dir_in, lst, multi = True, SJ = False):
     return figure
 
 
-def graphClustering(dir_in, lst, unweighted = True, SJ = False):
+def smallWorldParameters(df_lst, df_cc, p = 0.95):
+    """
+    Return the parameters of the small-world graphs compared with each frame:
+    as many nodes as junctions, and each node joined with the (m//n + 1)
+    nearest ones, m being the number of edges.
+
+    Parameters:
+    -----------
+    df_lst: list of pandas dataframes
+        The junctions of each frame.
+    df_cc: pandas dataframe
+        The clustering of each frame, see clusteringCoefficient.batchCC.
+    p: float, default 0.95
+        The probability of rewiring each edge.
+
+    Returns:
+    --------
+    parameters: list of tuples
+        The (n, k, p) of each frame, see nullModels.smallWorldCC.
+    """
+    
+    parameters = []
+    for k in range(len(df_lst)):
+        n = len(df_lst[k])
+        m = df_cc.at[k,'edges']
+        parameters += [(n, int(np.ceil((m//n) + 1)), p)]
+    
+    return parameters
+
+
+def graphClustering(dir_in, lst, unweighted = True, SJ = False, null_size = 10, seed = 0,
+                    workers = 1, null_cache = None):
     """
     Return a seaborn plot showing the mass of the junction with or without the
     loop counted and with or without the small junctions.
@@ -235,6 +272,16 @@ def graphClustering(dir_in, lst, unweighted = True, SJ = False):
         Indicate if you want the weighted or unweighted degree.
     SJ: boolean, default False
         Indicate if you want the small junctions counted or not.
+    null_size: int, default 10
+        Number of small-world graphs averaged for each frame, see
+        nullModels.smallWorldCC.
+    seed: int, default 0
+        Seed of the small-world graphs.
+    workers: int, default 1
+        Number of processes generating the small-world graphs.
+    null_cache: string, default None
+        Directory where the small-world ensembles are saved, see
+        nullModels.smallWorldEnsembles. Nothing is saved if None.
 
     Returns:
     --------
@@ -243,6 +290,9 @@ def graphClustering(dir_in, lst, unweighted = True, SJ = False):
         of the network.
     """
     
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    
     df_clustering = pd.DataFrame()
     df_random = pd.DataFrame()
     
@@ -266,21 +316,14 @@ def graphClustering(dir_in, lst, unweighted = True, SJ = False):
             typeList += [str(df_lst[0].at[0,'type'])]*n
             affinityRandomList += ['small world']*n
             #label = df_lst[0].at[0,'label']
+            df_cc = batchCC([toEdgeList(includeSJ(df, SJ)) for df in df_lst])
+            
+            # Compare with small-world graphs of the same size
+            parameters = smallWorldParameters(df_lst, df_cc)
+            SWList = smallWorldCC(parameters, null_size, seed, workers=workers, cache=null_cache)
             for k in range(len(df_lst)):
-                df_edges = toEdgeList(includeSJ(df_lst[k], SJ))
-                G, avgUWCC = unweightedCC(df_edges)
-                
-                # Get the parameters
-                n = len(df_lst[k])
-                L = list(G.degree())
-                M = [x[1] for x in L]
-                m = sum(M)/2
-               
-                # Create a small-world graph and exploit
-                k = int(np.ceil((m//n) + 1))
-                K = nx.connected_watts_strogatz_graph(n, k, 0.95, tries=100, seed=None)
-                
-                avgSW = nx.average_clustering(K)
+                avgUWCC = df_cc.at[k,'avgCC']
+                avgSW = SWList[k]
                 
                 CCList += [avgUWCC]
                 CCRandomList += [avgSW]
@@ -297,9 +340,9 @@ def graphClustering(dir_in, lst, unweighted = True, SJ = False):
                 break
             typeList += [str(df_lst[0].at[0,'type'])]*n
             # affinityRandomList += ['small world']*n
+            df_cc = batchCC([toEdgeList(includeSJ(df, SJ)) for df in df_lst])
             for k in range(len(df_lst)):
-                df_edges = toEdgeList(includeSJ(df_lst[k], SJ))
-                G, avgWCC = weightedCC(df_edges)
+                avgWCC = df_cc.at[k,'avgWCC']
                 
                 # # Get the parameters
                 # n = len(df_lst[k])
@@ -397,7 +440,8 @@ def graphClustering(dir_in, lst, unweighted = True, SJ = False):
         figure.set(ylim=(0,None))
         
 
-def graphClusteringComparison(dir_in, lst, SJ = False):
+def graphClusteringComparison(dir_in, lst, SJ = False, null_size = 10, seed = 0, workers = 1,
+                              null_cache = None):
     """
     Return a seaborn plot showing the mass of the junction with or without the
     loop counted and with or without the small junctions.
@@ -412,6 +456,16 @@ def graphClusteringComparison(dir_in, lst, SJ = False):
         Indicate if you want the weighted or unweighted degree.
     SJ: boolean, default False
         Indicate if you want the small junctions counted or not.
+    null_size: int, default 10
+        Number of small-world graphs averaged for each frame, see
+        nullModels.smallWorldCC.
+    seed: int, default 0
+        Seed of the small-world graphs.
+    workers: int, default 1
+        Number of processes generating the small-world graphs.
+    null_cache: string, default None
+        Directory where the small-world ensembles are saved, see
+        nullModels.smallWorldEnsembles. Nothing is saved if None.
 
     Returns:
     --------
@@ -420,6 +474,9 @@ def graphClusteringComparison(dir_in, lst, SJ = False):
         of the network.
     """
     
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    
     df_clusteringCC = pd.DataFrame()
     df_random = pd.DataFrame()
     
@@ -442,21 +499,14 @@ def graphClusteringComparison(dir_in, lst, SJ = False):
             break
         CCtypeList += [str(df_lst[0].at[0,'type'])]*n
         affinityRandomList += ['small world']*n
+        df_cc = batchCC([toEdgeList(includeSJ(df, SJ)) for df in df_lst])
+        
+        # Compare with small-world graphs of the same size
+        parameters = smallWorldParameters(df_lst, df_cc)
+        SWList = smallWorldCC(parameters, null_size, seed, workers=workers, cache=null_cache)
         for k in range(len(df_lst)):
-            df_edges = toEdgeList(includeSJ(df_lst[k], SJ))
-            G, avgUWCC = unweightedCC(df_edges)
-            
-            # Get the parameters
-            n = len(df_lst[k])
-            L = list(G.degree())
-            M = [x[1] for x in L]
-            m = sum(M)/2
-           
-            # Create a small-world graph and exploit
-            k = int(np.ceil((m//n) + 1))
-            K = nx.connected_watts_strogatz_graph(n, k, 0.95, tries=100, seed=None)
-            
-            avgSW = nx.average_clustering(K)
+            avgUWCC = df_cc.at[k,'avgCC']
+            avgSW = SWList[k]
             
             CCList += [avgUWCC]
             CCRandomList += [avgSW]
@@ -523,9 +573,9 @@ def graphClusteringComparison(dir_in, lst, SJ = False):
             print(name)
             break
         WCCtypeList += [str(df_lst[0].at[0,'type'])]*n
+        df_cc = batchCC([toEdgeList(includeSJ(df, SJ)) for df in df_lst])
         for k in range(len(df_lst)):
-            df_edges = toEdgeList(includeSJ(df_lst[k], SJ))
-            G, avgWCC = weightedCC(df_edges)
+            avgWCC = df_cc.at[k,'avgWCC']
             
             
             WCCList += [avgWCC]
@@ -604,6 +654,8 @@ def graphFluidity(dir_in, filename):
         The plot showing the evolution of the average fluidity of the network.
     """
     
+    import seaborn as sns
+    
     dir_path = Path(os.getcwd()) 
     file_path = dir_path.parent.joinpath(dir_in, filename)
     df = pd.read_pickle(file_path)
@@ -646,5 +698,6 @@ T = ['4/6e48/14001', '4/6e48/14002', '4/6e48/14003', '4/6e48/14004',
 ## Graphs generations
 # =============================================================================
 
-graphClustering('neo_junctions',T[:8])
+if __name__ == '__main__':
+    graphClustering('neo_junctions',T[:8])
 
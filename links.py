@@ -8,17 +8,11 @@ Created on Thu Feb  3 10:14:10 2022
 
 import pandas as pd
 import numpy as np
-import seaborn as sns
 import networkx as nx
-import os
-import matplotlib.pyplot as plt
-import mpl_toolkits.mplot3d.axes3d as p3
 
-from mpl_toolkits.mplot3d import proj3d
-from matplotlib.patches import FancyArrowPatch
-from pathlib import Path
+# seaborn and matplotlib are imported by the plotting functions, when used
 from utilitaries import toEdgeList, dfListConnex, includeSJ
-from clusteringCoefficient import unweightedCC, weightedCC, multigraphClustering
+from clusteringCoefficient import weightedCC, multigraphClustering
 
 
 
@@ -46,6 +40,9 @@ def graphLinks(dir_in, lst, unweighted = True, SJ = False):
         of the network.
     """
     
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    
     
     
     affinityList = []
@@ -60,7 +57,7 @@ def graphLinks(dir_in, lst, unweighted = True, SJ = False):
         axes = fig.subplots(nrows=2, ncols=m)
         typeList += [str(df_lst[0].at[0,'type'])]
         for k in range(len(df_lst)):
-            df_edges = toEdgeList(includeSJ(df_lst[k], SJ))
+            df_edges = toEdgeList(includeSJ(df_lst[k], SJ), multigraph=True)
             G, avgUWCC = weightedCC(df_edges)
             
             N = list(G.nodes())
@@ -103,11 +100,13 @@ R = ['2B/6091',
      '6E/14003']
 
 def artificialLinks(dir_in, lst, unweighted = True, SJ = False):
+    import seaborn as sns
+    
     L = []
     for name in lst:
         df_lst = dfListConnex(dir_in, name)
         for k in range(len(df_lst)):
-            data_edges = toEdgeList(includeSJ(df_lst[k], SJ))
+            data_edges = toEdgeList(includeSJ(df_lst[k], SJ), multigraph=not unweighted)
             if unweighted:
                 G = nx.from_pandas_edgelist(data_edges, 'source', 'target', create_using=nx.Graph())
             else:
@@ -139,6 +138,7 @@ def artificialLinks(dir_in, lst, unweighted = True, SJ = False):
         sns.violinplot(x='run',y='avgWCC', data=df)
         
 
-for k in range(4):
-    graphLinks('neo_junctions',R[k:k+1])
+if __name__ == '__main__':
+    for k in range(4):
+        graphLinks('neo_junctions',R[k:k+1])
     
\ No newline at end of file
@@ -10,18 +10,61 @@ Created on Thu Nov 25 13:31:37 2021
 ## Library dependancies
 # =============================================================================
 
-import pandas as pd
 import os
 import numpy as np
 from pathlib import Path
-from os.path import isfile, join
+from concurrent.futures import ProcessPoolExecutor
+
+from utilitaries import saveCSR, pairDistance
+from storage import listFrames, loadFrame, saveFrame, frameStem, FORMATS
+from cache import cacheKey, cacheLoad, cacheStore, cacheEvict
 
 # =============================================================================
 ## Basic functions
 # =============================================================================
 
 
-def dist_matrix(data, box_size = 48, boundary = 'pbc'):
+def distBlocks(X, box_size = 48, boundary = 'pbc', chunk_size = 1024):
+    """
+    Stream the upper triangular part of the distance matrix, chunk_size rows
+    at a time.
+
+    Parameters:
+    -----------
+    X: numpy array
+        Array of shape (n, 3) with the x, y and z coordinates of the points.
+    box_size: int
+        Size of the simulation box.
+    boundary: 'pbc' or 'npbc', default 'pbc'
+        Type of boundary.
+    chunk_size: int, default 1024
+        Number of rows computed at once, the memory used is of the order of
+        chunk_size * n.
+
+    Yields:
+    -------
+    start, block: int, numpy array
+        block[k, l] is the distance between the points start+k and start+l,
+        set to 0 when start+l <= start+k.
+    """
+    
+    X = np.asarray(X, dtype=float)
+    n = len(X)
+    
+    if boundary not in ['pbc', 'npbc']:
+        print('Boundaries of type {} are not understood, please use pbc for'.format(boundary) +
+              ' periodic boundaries or npbc for non periodic ones.')
+        return
+    
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        block = pairDistance(X[start:stop, None, :], X[None, start:, :],
+                             box_size, boundary)
+        block[np.tril_indices(stop - start, 0, n - start)] = 0
+        yield start, block
+
+
+def dist_matrix(data, box_size = 48, boundary = 'pbc', chunk_size = 1024):
     """
     Computes the distance between every points in a 3D box with periodic or non perciodic boundary.
 
@@ -33,56 +76,375 @@ def dist_matrix(data, box_size = 48, boundary = 'pbc'):
         Size of the simulation box.
     boundary: 'pbc' or 'npbc', default 'pbc'
         Type of boundary.
+    chunk_size: int, default 1024
+        Number of rows computed at once, see distBlocks.
 
     Returns:
     --------
     D: numpy array
         Distance matrix between every point of the data, in truth only the upper
-        triangular part of the matrix is returned. Uncomment N if you wish the
-        full distance matrix.
+        triangular part of the matrix is returned. Add its transpose if you
+        wish the full distance matrix.
     """
     
-    D = []
+    if boundary not in ['pbc', 'npbc']:
+        print('Boundaries of type {} are not understood, please use pbc for'.format(boundary) +
+              ' periodic boundaries or npbc for non periodic ones.')
+        return np.array([])
+    
     n = len(data)
+    D = np.zeros((n, n))
+    for start, block in distBlocks(data[['x','y','z']].to_numpy(), box_size,
+                                   boundary, chunk_size):
+        D[start:start+len(block), start:] = block
+    return D
+
+
+def bruteForce(X, searchRadius, box_size, boundary = 'pbc', chunk_size = 1024):
+    """
+    Return every pair of points closer than searchRadius, checking all the
+    pairs block by block.
+
+    Parameters:
+    -----------
+    X: numpy array
+        Array of shape (n, 3) with the x, y and z coordinates of the points.
+    searchRadius: float
+        Radius of the sphere.
+    box_size: int
+        Size of the simulation box.
+    boundary: 'pbc' or 'npbc', default 'pbc'
+        Type of boundary.
+    chunk_size: int, default 1024
+        Number of rows computed at once, see distBlocks.
+
+    Returns:
+    --------
+    I, J, D: numpy arrays
+        The indices of the two points of each pair (always I < J) and their
+        distance.
+    """
+    
+    I = [np.array([], dtype=int)]
+    J = [np.array([], dtype=int)]
+    D = [np.array([])]
+    for start, block in distBlocks(X, box_size, boundary, chunk_size):
+        k, l = np.nonzero(block < searchRadius)
+        keep = l > k
+        k, l = k[keep], l[keep]
+        I += [k + start]
+        J += [l + start]
+        D += [block[k, l]]
+    
+    return np.concatenate(I), np.concatenate(J), np.concatenate(D)
+
+
+def cellList(X, searchRadius, box_size, boundary = 'pbc'):
+    """
+    Return every pair of points closer than searchRadius, using a linked-cell
+    search: the points are binned in cells at least searchRadius wide and only
+    the adjacent cells are checked.
+
+    Parameters:
+    -----------
+    X: numpy array
+        Array of shape (n, 3) with the x, y and z coordinates of the points.
+    searchRadius: float
+        Radius of the sphere.
+    box_size: int
+        Size of the simulation box.
+    boundary: 'pbc' or 'npbc', default 'pbc'
+        Type of boundary. With 'pbc' the cells wrap around the box and the
+        minimum image convention is used for the distances.
+
+    Returns:
+    --------
+    I, J, D: numpy arrays
+        The indices of the two points of each pair (always I < J) and their
+        distance.
+    """
+    
+    X = np.asarray(X, dtype=float)
+    n = len(X)
+    empty = (np.array([], dtype=int), np.array([], dtype=int), np.array([]))
     
     if boundary == 'pbc':
-        for i in range(n):
-            pi = data.iloc[i][['x','y','z']]
-            L = [0 for i in range(i+1)]
-            for j in range(i+1,n):
-                pj = data.iloc[j][['x','y','z']]
-                x_dist, y_dist, z_dist = abs(pi-pj)
-                
-                euclidean_distance = np.sqrt(min(box_size - x_dist,x_dist)**2
-                                               + min(box_size - y_dist,y_dist)**2
-                                               + min(box_size - z_dist,z_dist)**2)
-                L += [euclidean_distance]
-            D += [L]
+        ncell = np.array([max(int(box_size // searchRadius), 1)]*3)
+        width = box_size / ncell
+        C = np.floor(np.mod(X, box_size) / width).astype(int)
     elif boundary == 'npbc':
-        for i in range(n):
-            a = data.iloc[i][['x','y','z']]
-            L = [0 for i in range(i+1)]
-            for j in range(i+1,n):
-                b = data.iloc[j][['x','y','z']]
-                x_dist = (a-b)['x']
-                y_dist = (a-b)['y']
-                z_dist = (a-b)['z']
+        if n == 0:
+            return empty
+        low = X.min(axis=0)
+        extent = X.max(axis=0) - low
+        ncell = np.maximum(np.floor(extent / searchRadius).astype(int), 1)
+        width = np.where(extent > 0, extent / ncell, searchRadius)
+        C = np.floor((X - low) / width).astype(int)
+    else:
+        print('Boundaries of type {} are not understood, please use pbc for'.format(boundary) +
+              ' periodic boundaries or npbc for non periodic ones.')
+        return empty
+    C = np.minimum(C, ncell - 1)
+    
+    # Sort the points by cell so each cell is a contiguous slice of order
+    cell = (C[:,0]*ncell[1] + C[:,1])*ncell[2] + C[:,2]
+    order = np.argsort(cell, kind='stable')
+    counts = np.bincount(cell, minlength=np.prod(ncell))
+    starts = np.cumsum(counts) - counts
+    
+    # With less than 3 cells along an axis, -1 and +1 would be the same cell
+    shifts = [[-1, 0, 1] if (boundary == 'npbc') or (m >= 3) else list(range(m))
+              for m in ncell]
+    
+    I, J, D = [], [], []
+    points = np.arange(n)
+    for sx in shifts[0]:
+        for sy in shifts[1]:
+            for sz in shifts[2]:
+                N = C + [sx, sy, sz]
+                if boundary == 'pbc':
+                    N = np.mod(N, ncell)
+                    valid = points
+                else:
+                    inside = np.all((N >= 0) & (N < ncell), axis=1)
+                    valid = points[inside]
+                    N = N[inside]
+                neighbour_cell = (N[:,0]*ncell[1] + N[:,1])*ncell[2] + N[:,2]
+                
+                # Expand each point against every point of the adjacent cell
+                cnt = counts[neighbour_cell]
+                i = np.repeat(valid, cnt)
+                first = np.repeat(starts[neighbour_cell] - (np.cumsum(cnt) - cnt), cnt)
+                j = order[first + np.arange(cnt.sum())]
+                
+                keep = i < j
+                i, j = i[keep], j[keep]
+                d = pairDistance(X[i], X[j], box_size, boundary)
                 
-                euclidean_distance = np.sqrt(x_dist**2
-                                               + y_dist**2
-                                               + z_dist**2)
-                L += [euclidean_distance]
-            D += [L]
+                keep = d < searchRadius
+                I += [i[keep]]
+                J += [j[keep]]
+                D += [d[keep]]
+    
+    return np.concatenate(I), np.concatenate(J), np.concatenate(D)
+
+
+def pairsToNearest(data, I, J, D):
+    """
+    Return the nearest column built from a list of pairs of close points.
+
+    Parameters:
+    -----------
+    data: pandas dataframe
+        data must contain at least two columns named polyIndex and beadPosition.
+    I, J, D: numpy arrays
+        The indices of the two points of each pair (I < J) and their distance.
+
+    Returns:
+    --------
+    nearest: list
+        For each point i, the list of [distance, j, polyIndex, beadPosition]
+        of its neighbours j > i, sorted by distance.
+    """
+    
+    n = len(data)
+    order = np.lexsort((J, D, I))
+    I, J, D = I[order], J[order], D[order]
+    
+    poly = data['polyIndex'].to_numpy()[J]
+    bead = data['beadPosition'].to_numpy()[J]
+    N = [list(elem) for elem in zip(D.tolist(), J.tolist(), poly, bead)]
+    bounds = np.searchsorted(I, np.arange(n+1)).tolist()
+    
+    return [N[bounds[i]:bounds[i+1]] for i in range(n)]
+
+
+def slabSearch(X, owned, searchRadius, box_size, boundary, method, chunk_size):
+    """
+    Return the pairs of close points of one slab, see slabPairs.
+
+    Parameters:
+    -----------
+    X: numpy array
+        Coordinates of the points of the slab and of its halo, in the order
+        of the full data.
+    owned: numpy array
+        Boolean array, True for the points inside the slab.
+    searchRadius, box_size, boundary, method, chunk_size:
+        See findPairs.
+
+    Returns:
+    --------
+    I, J, D: numpy arrays
+        The pairs whose first point (I < J) is inside the slab, in the indices
+        of X.
+    """
+    
+    I, J, D = findPairs(X, searchRadius, box_size, boundary, method, chunk_size)
+    keep = owned[I]
+    return I[keep], J[keep], D[keep]
+
+
+def slabPairs(X, searchRadius, box_size, boundary, workers, method = 'cell',
+              chunk_size = 1024):
+    """
+    Return every pair of points closer than searchRadius, splitting the box
+    along x in one slab per worker. Each slab is searched with a halo
+    searchRadius thick in a separate process.
+
+    Parameters:
+    -----------
+    X: numpy array
+        Array of shape (n, 3) with the x, y and z coordinates of the points.
+    searchRadius: float
+        Radius of the sphere.
+    box_size: int
+        Size of the simulation box.
+    boundary: 'pbc' or 'npbc'
+        Type of boundary.
+    workers: int
+        Number of slabs and of worker processes.
+    method: 'brute' or 'cell', default 'cell'
+        Algorithm used in each slab, see findPairs.
+    chunk_size: int, default 1024
+        Number of rows of the distance matrix computed at once by the brute
+        search.
+
+    Returns:
+    --------
+    I, J, D: numpy arrays
+        The same pairs as findPairs.
+    """
+    
+    X = np.asarray(X, dtype=float)
+    x = X[:,0]
+    
+    if boundary == 'pbc':
+        x = np.mod(x, box_size)
+        low, width = 0, box_size / workers
+    elif boundary == 'npbc':
+        low = x.min() if len(x) else 0
+        width = max((x.max() - low) / workers, searchRadius) if len(x) else 1
     else:
         print('Boundaries of type {} are not understood, please use pbc for'.format(boundary) +
               ' periodic boundaries or npbc for non periodic ones.')
-    M = np.array(D)
-    #N = M.transpose() # Create the lower triangular matrix of distances.
-    D = M #+N # Create the full matrix of distances.
-    return D
+        return None
+    slab = np.minimum(np.floor((x - low) / width).astype(int), workers - 1)
+    
+    points, tasks = [], []
+    for k in range(workers):
+        # the halo holds every point that may be closer than searchRadius
+        # to a point of the slab
+        offset = x - (low + k*width)
+        if boundary == 'pbc':
+            offset = np.mod(offset, box_size)
+            inside = (offset <= width + searchRadius) | (offset >= box_size - searchRadius)
+        else:
+            inside = (offset >= -searchRadius) & (offset <= width + searchRadius)
+        inside |= (slab == k)
+        P = np.nonzero(inside)[0]
+        points += [P]
+        tasks += [(X[P], slab[P] == k)]
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(slabSearch, Y, owned, searchRadius, box_size,
+                                   boundary, method, chunk_size)
+                   for Y, owned in tasks]
+        results = [future.result() for future in futures]
+    
+    # A pair is only kept by the slab of its first point, so the merged
+    # pairs have no duplicates
+    I = np.concatenate([P[R[0]] for P, R in zip(points, results)])
+    J = np.concatenate([P[R[1]] for P, R in zip(points, results)])
+    D = np.concatenate([R[2] for R in results])
+    
+    return I, J, D
+
+
+def knownMethod(method):
+    """
+    Tell if method is a search method, print a message if it is not.
+    """
+    
+    if method not in ['brute', 'cell']:
+        print('Search method {} is not understood, please use brute for'.format(method) +
+              ' every pair of points or cell for the linked-cell search.')
+        return False
+    return True
+
+
+def findPairs(X, searchRadius, box_size, boundary, method = 'brute',
+              chunk_size = 1024, workers = 1):
+    """
+    Return every pair of points closer than searchRadius with the chosen
+    search method.
+
+    Parameters:
+    -----------
+    X: numpy array
+        Array of shape (n, 3) with the x, y and z coordinates of the points.
+    searchRadius: float
+        Radius of the sphere.
+    box_size: int
+        Size of the simulation box.
+    boundary: 'pbc' or 'npbc'
+        Type of boundary.
+    method: 'brute' or 'cell', default 'brute'
+        Algorithm used for the search, either every pair of points or the
+        linked-cell search. Both give the same pairs.
+    chunk_size: int, default 1024
+        Number of rows of the distance matrix computed at once by the brute
+        search.
+    workers: int, default 1
+        Number of processes. With more than one, the box is split in slabs
+        searched in parallel, see slabPairs.
+
+    Returns:
+    --------
+    I, J, D: numpy arrays
+        The indices of the two points of each pair (always I < J) and their
+        distance. None if the method is not understood.
+    """
+    
+    if not knownMethod(method):
+        return None
+    elif workers > 1:
+        return slabPairs(X, searchRadius, box_size, boundary, workers, method,
+                         chunk_size)
+    elif method == 'brute':
+        return bruteForce(X, searchRadius, box_size, boundary, chunk_size)
+    else:
+        return cellList(X, searchRadius, box_size, boundary)
+
+
+def pairsToCSR(n, I, J, D):
+    """
+    Return the compressed sparse row (CSR) form of the nearest column built
+    from a list of pairs of close points.
+
+    Parameters:
+    -----------
+    n: int
+        Number of points.
+    I, J, D: numpy arrays
+        The indices of the two points of each pair (I < J) and their distance.
+
+    Returns:
+    --------
+    offsets, indices, distances: numpy arrays
+        The neighbours of the point i are indices[offsets[i]:offsets[i+1]]
+        (int32), at distances[offsets[i]:offsets[i+1]] (float32), sorted by
+        distance as in the nearest column.
+    """
+    
+    order = np.lexsort((J, D, I))
+    offsets = np.searchsorted(I[order], np.arange(n+1)).astype(np.int64)
+    
+    return offsets, J[order].astype(np.int32), D[order].astype(np.float32)
 
 
-def neighbours(data, searchRadius, box_size, boundary):
+def neighbours(data, searchRadius, box_size, boundary, method = 'brute',
+               chunk_size = 1024, workers = 1):
     """
     Return the data with a new column containing the points that are least in a
     sphere of radius searchRadius around each point of the data.
@@ -93,6 +455,13 @@ def neighbours(data, searchRadius, box_size, boundary):
         data must contain at least three columns named x, y and z.
     searchRadius: float
         Radius of the sphere.
+    method: 'brute' or 'cell', default 'brute'
+        Algorithm used for the search, see findPairs.
+    chunk_size: int, default 1024
+        Number of rows of the distance matrix computed at once by the brute
+        search.
+    workers: int, default 1
+        Number of processes used for the search, see slabPairs.
 
     Returns:
     --------
@@ -100,43 +469,127 @@ def neighbours(data, searchRadius, box_size, boundary):
         A new dataframe with the neighbours added for each point.
     """
     
-    M = dist_matrix(data, box_size, boundary)
-    n = M.shape[0]
-    D = []
-    
-    for i in range(n):
-        #print("row {:02d} / {}".format(i+1,n))
-        L = M[i].tolist()
-        N = [[L[j],j,data.at[j,'polyIndex'],data.at[j,'beadPosition']] for j in range(n)]
-        N = sorted(N)
-        D_prime = []
-        #print(N)
-        j = i+1
-        test = True
-        while test:
-            try:
-                p = N[j][0]
-                if p < searchRadius:
-                    D_prime += [N[j]]
-                    j += 1
-                else:
-                    test = False
-            except IndexError:
-                test = False      
-        D += [D_prime]
+    pairs = findPairs(data[['x','y','z']].to_numpy(), searchRadius, box_size,
+                      boundary, method, chunk_size, workers)
+    if pairs is None:
+        return None
     
     data2 = data.copy(deep=True)
-    data2['nearest'] = D
+    data2['nearest'] = pairsToNearest(data, *pairs)
     
     return data2
 
 
+def neighboursCSR(data, searchRadius, box_size, boundary, method = 'brute',
+                  chunk_size = 1024, workers = 1):
+    """
+    Return the points that are least in a sphere of radius searchRadius around
+    each point of the data, in compressed sparse row (CSR) form. The polyIndex
+    and beadPosition of the neighbours are not stored, they are read from the
+    data with the neighbour indices.
+
+    Parameters:
+    -----------
+    data: pandas dataframe
+        data must contain at least three columns named x, y and z.
+    searchRadius: float
+        Radius of the sphere.
+    method: 'brute' or 'cell', default 'brute'
+        Algorithm used for the search, see findPairs.
+    chunk_size: int, default 1024
+        Number of rows of the distance matrix computed at once by the brute
+        search.
+    workers: int, default 1
+        Number of processes used for the search, see slabPairs.
+
+    Returns:
+    --------
+    offsets, indices, distances: numpy arrays
+        See pairsToCSR.
+    """
+    
+    pairs = findPairs(data[['x','y','z']].to_numpy(), searchRadius, box_size,
+                      boundary, method, chunk_size, workers)
+    if pairs is None:
+        return None
+    
+    return pairsToCSR(len(data), *pairs)
+
+
+def verletNeighbours(data, searchRadius, box_size, boundary, skin, verlet = None,
+                     method = 'cell', chunk_size = 1024, workers = 1):
+    """
+    Return every pair of points closer than searchRadius, reusing a Verlet
+    list: the candidate pairs closer than searchRadius + skin are kept from a
+    previous frame and only filtered again, until a point has moved by more
+    than skin/2 since the list was built.
+
+    Parameters:
+    -----------
+    data: pandas dataframe
+        data must contain at least three columns named x, y and z, and two
+        columns named polyIndex and beadPosition.
+    searchRadius: float
+        Radius of the sphere.
+    box_size: int
+        Size of the simulation box.
+    boundary: 'pbc' or 'npbc'
+        Type of boundary.
+    skin: float
+        Extra radius of the candidate pairs.
+    verlet: dict, default None
+        The Verlet list returned for the previous frame. If None, or if it
+        does not match this frame, the list is built from scratch.
+    method: 'brute' or 'cell', default 'cell'
+        Algorithm used when the list is built, see findPairs.
+    chunk_size: int, default 1024
+        Number of rows of the distance matrix computed at once by the brute
+        search.
+    workers: int, default 1
+        Number of processes used when the list is built, see slabPairs.
+
+    Returns:
+    --------
+    (I, J, D), verlet: tuple of numpy arrays, dict
+        The pairs as given by findPairs, and the Verlet list to give for the
+        next frame.
+    """
+    
+    X = data[['x','y','z']].to_numpy(dtype=float)
+    ids = data[['polyIndex','beadPosition']].to_numpy()
+    parameters = (searchRadius, box_size, boundary, skin)
+    
+    rebuild = ((verlet is None) or (verlet['parameters'] != parameters)
+               or (verlet['ids'].shape != ids.shape)
+               or not (verlet['ids'] == ids).all())
+    if not rebuild:
+        displacement = pairDistance(X, verlet['X'], box_size, boundary)
+        rebuild = (len(X) > 0) and (displacement.max() > skin/2)
+    
+    if rebuild:
+        pairs = findPairs(X, searchRadius + skin, box_size, boundary, method,
+                          chunk_size, workers)
+        if pairs is None:
+            return None, verlet
+        verlet = {'X': X, 'ids': ids, 'parameters': parameters,
+                  'I': pairs[0], 'J': pairs[1]}
+    
+    I, J = verlet['I'], verlet['J']
+    D = pairDistance(X[I], X[J], box_size, boundary)
+    keep = D < searchRadius
+    
+    return (I[keep], J[keep], D[keep]), verlet
+
+
 # =============================================================================
 ## Main function
 # =============================================================================
 
 
-def mainNeighbors(dir_in, dir_out, name, searchRadius = 1.5, box_size = 48, boundary = 'pbc'):
+def mainNeighbors(dir_in, dir_out, name, searchRadius = 1.5, box_size = 48,
+                  boundary = 'pbc', method = 'brute', chunk_size = 1024,
+                  layout = 'list', skin = None, workers = 1, fmt = 'pkl', cache = None,
+                  cache_size = None):
     """
     Do the neighbours search for a bunch of file and save the result in a (new)
     directory.
@@ -152,6 +605,34 @@ def mainNeighbors(dir_in, dir_out, name, searchRadius = 1.5, box_size = 48, boun
         Subdirectory where the script will take the files.
     searchRadius: float, default 1.5
         Radius of the sphere.
+    method: 'brute' or 'cell', default 'brute'
+        Algorithm used for the search, see neighbours.
+    chunk_size: int, default 1024
+        Number of rows of the distance matrix computed at once by the brute
+        search.
+    layout: 'list' or 'csr', default 'list'
+        With 'list' the neighbours are saved in the nearest column of the
+        dataframe. With 'csr' the dataframe is saved unchanged and the
+        neighbours are saved beside it in a .npz file of the same name, see
+        neighboursCSR.
+    skin: float, default None
+        If given, a Verlet list of the pairs closer than searchRadius + skin
+        is carried from one file to the next and only rebuilt when a point
+        has moved by more than skin/2, see verletNeighbours. The files must
+        be consecutive frames of the same run.
+    workers: int, default 1
+        Number of processes used for the search of each file, see slabPairs.
+    fmt: 'pkl' or 'frame', default 'pkl'
+        Format of the saved files, see storage.saveFrame. The input files
+        can be in either format.
+    cache: string, default None
+        Cache directory. If given, the outputs of each file are cached under
+        the hash of the file and the parameters (searchRadius, box_size,
+        boundary, layout and fmt), and restored instead of computed when the
+        same file is searched again with the same parameters, see cache.py.
+    cache_size: int, default None
+        Size limit of the cache in bytes, no limit if None. The least recently
+        used entries are evicted once all the files are done.
 
     Returns:
     --------
@@ -159,32 +640,61 @@ def mainNeighbors(dir_in, dir_out, name, searchRadius = 1.5, box_size = 48, boun
     {name} under the output directory.
     """
     
+    if not knownMethod(method):
+        return None
+    
     dir_path = Path(os.getcwd()) 
     path = dir_path.parent.joinpath(dir_in,name)
     save_path = dir_path.parent.joinpath(dir_out,name)
     save_path.mkdir(parents=True, exist_ok=True)
     
-    # work on each files
-    onlyfiles = [f for f in os.listdir(path) if isfile(join(path, f))]
+    cache_path = None if cache is None else dir_path.parent.joinpath(cache)
+    params = {'searchRadius': searchRadius, 'box_size': box_size, 'boundary': boundary,
+              'layout': layout, 'fmt': fmt}
+    suffixes = [FORMATS[fmt], '.npz'] if layout == 'csr' else [FORMATS[fmt]]
     
-    file_list = []
-    for filename in onlyfiles:
-        if filename.endswith('.pkl'):
-            file_list.append(filename)
-    file_list.sort()
+    # work on each files
+    file_list = listFrames(path)
     n = len(file_list)
     
+    verlet = None
     for i in range(n):
         print("file {:02d} / {}".format(i+1,n))
         file_path = os.path.join(path,file_list[i])
-        df0 = pd.read_pickle(file_path)
-        df1 = neighbours(df0, searchRadius, box_size, boundary)
+        save_name = save_path.joinpath(frameStem(file_list[i]))
+        if cache_path is not None:
+            key = cacheKey([file_path], 'neighbors', params)
+            if cacheLoad(cache_path, key, save_name):
+                continue
+        df0 = loadFrame(file_path)
         
-        save_name = save_path.joinpath(file_list[i])
-        df1.to_pickle(save_name)
+        if skin is None:
+            pairs = findPairs(df0[['x','y','z']].to_numpy(), searchRadius,
+                              box_size, boundary, method, chunk_size, workers)
+        else:
+            pairs, verlet = verletNeighbours(df0, searchRadius, box_size,
+                                             boundary, skin, verlet, method,
+                                             chunk_size, workers)
+        if pairs is None:
+            return None
+        
+        if layout == 'csr':
+            saveFrame(df0, save_name, fmt)
+            saveCSR(str(save_name) + '.npz', *pairsToCSR(len(df0), *pairs))
+        else:
+            df1 = df0.copy(deep=True)
+            df1['nearest'] = pairsToNearest(df0, *pairs)
+            saveFrame(df1, save_name, fmt)
+        
+        if cache_path is not None:
+            cacheStore(cache_path, key, save_name, suffixes)
+    
+    if (cache_path is not None) and (cache_size is not None):
+        cacheEvict(cache_path, cache_size)
         
 
-L = ['6d48']
-for elem in L:
-    #mainNeighbors('neo_clean_pbc/4', 'neo_KNN/4', elem)
-    mainNeighbors('neo_clean_pbc/65', 'neo_KNN/65', elem)
\ No newline at end of file
+if __name__ == '__main__':
+    L = ['6d48']
+    for elem in L:
+        #mainNeighbors('neo_clean_pbc/4', 'neo_KNN/4', elem)
+        mainNeighbors('neo_clean_pbc/65', 'neo_KNN/65', elem)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Null models of the junction networks.
+"""
+
+# =============================================================================
+## Library dependancies
+# =============================================================================
+
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from os.path import isfile
+from concurrent.futures import ProcessPoolExecutor
+
+from clusteringCoefficient import batchCC
+
+# =============================================================================
+## Small-world ensembles
+# =============================================================================
+
+"""
+The clustering of a network is compared with the one of small-world graphs
+(connected Watts-Strogatz graphs) with the same number of nodes. An ensemble
+of such graphs is drawn for each (n, k, p, seed): the graphs are generated in
+a process pool, then their clustering coefficients are computed all at once
+with clusteringCoefficient.batchCC. The ensembles are memoized in memory,
+read-only, and can be saved in a cache directory, so drawing the same
+ensemble again costs nothing.
+"""
+
+# ensembles already drawn in this process, by parameters
+ENSEMBLES = {}
+
+
+def wattsStrogatzEdges(n, k, p, seed, tries = 100):
+    """
+    Return the edges of a connected Watts-Strogatz graph.
+
+    Parameters:
+    -----------
+    n: int
+        Number of nodes.
+    k: int
+        Each node is joined with its k nearest neighbors in a ring topology.
+    p: float
+        The probability of rewiring each edge.
+    seed: int
+        Seed of the random number generator.
+    tries: int, default 100
+        Number of attempts to generate a connected graph.
+
+    Returns:
+    --------
+    edges: numpy array
+        Array of shape (m, 2) with the extremities of each edge.
+    """
+    
+    import networkx as nx
+    
+    G = nx.connected_watts_strogatz_graph(n, k, p, tries=tries, seed=seed)
+    return np.array(list(G.edges()), dtype=np.int64).reshape(-1, 2)
+
+
+def ensembleName(n, k, p, seed, size, tries):
+    """
+    Return the name of the file of an ensemble in the cache directory.
+    """
+    
+    return 'ws_n{}_k{}_p{}_seed{}_size{}_tries{}.npy'.format(n, k, p, seed, size, tries)
+
+
+def smallWorldEnsembles(parameters, size = 10, seed = 0, tries = 100, workers = 1,
+                        cache = None):
+    """
+    Return the average clustering coefficients of ensembles of small-world
+    graphs.
+
+    Parameters:
+    -----------
+    parameters: list of tuples
+        The (n, k, p) of each ensemble, see wattsStrogatzEdges.
+    size: int, default 10
+        Number of graphs in each ensemble.
+    seed: int, default 0
+        Seed of the ensembles, the graph i of the ensemble (n, k, p) is
+        always the same for the same seed.
+    tries: int, default 100
+        Number of attempts to generate each connected graph.
+    workers: int, default 1
+        Number of processes generating the graphs.
+    cache: string, default None
+        Directory where the ensembles are saved, in the parent of the working
+        directory like the input and output directories ('null_models' from
+        the command line). Nothing is saved if None.
+
+    Returns:
+    --------
+    ensembles: dict
+        The average clustering coefficient of each graph (read-only numpy
+        array of length size, shared with the memoized ensembles) of each
+        ensemble, by (n, k, p).
+    """
+    
+    cache_path = None
+    if cache is not None:
+        cache_path = Path(os.getcwd()).parent.joinpath(cache)
+        cache_path.mkdir(parents=True, exist_ok=True)
+    
+    ensembles = {}
+    missing = []
+    for n, k, p in set(parameters):
+        key = (n, k, p, seed, size, tries)
+        file_path = None if cache_path is None else cache_path.joinpath(ensembleName(*key))
+        if key in ENSEMBLES:
+            ensembles[(n, k, p)] = ENSEMBLES[key]
+            if (file_path is not None) and not isfile(file_path):
+                np.save(file_path, ENSEMBLES[key])
+        elif (file_path is not None) and isfile(file_path):
+            ENSEMBLES[key] = np.load(file_path)
+            ENSEMBLES[key].flags.writeable = False
+            ensembles[(n, k, p)] = ENSEMBLES[key]
+        else:
+            missing += [(n, k, p)]
+    
+    if missing:
+        # one independent seed per graph, derived from the seed and the parameters
+        tasks = []
+        for n, k, p in missing:
+            entropy = [seed, n, k, int(round(p * 10**9)), tries]
+            seeds = np.random.SeedSequence(entropy).generate_state(size)
+            tasks += [(n, k, p, int(s), tries) for s in seeds]
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            edges = list(executor.map(wattsStrogatzEdges, *zip(*tasks)))
+        
+        edge_lists = [pd.DataFrame({'source': E[:,0], 'target': E[:,1],
+                                    'links': np.ones(len(E), dtype=np.int64)}) for E in edges]
+        avgCC = batchCC(edge_lists)['avgCC'].to_numpy()
+        
+        for i, (n, k, p) in enumerate(missing):
+            key = (n, k, p, seed, size, tries)
+            ENSEMBLES[key] = avgCC[i*size:(i+1)*size]
+            ENSEMBLES[key].flags.writeable = False
+            ensembles[(n, k, p)] = ENSEMBLES[key]
+            if cache_path is not None:
+                np.save(cache_path.joinpath(ensembleName(*key)), ENSEMBLES[key])
+    
+    return ensembles
+
+
+def smallWorldCC(parameters, size = 10, seed = 0, tries = 100, workers = 1,
+                 cache = None):
+    """
+    Return the mean of the average clustering coefficients of the small-world
+    ensemble of each (n, k, p), see smallWorldEnsembles.
+
+    Parameters:
+    -----------
+    parameters: list of tuples
+        The (n, k, p) of each network to compare, repeated parameters are
+        drawn once.
+    size, seed, tries, workers, cache:
+        See smallWorldEnsembles.
+
+    Returns:
+    --------
+    CC: list of floats
+        The mean clustering coefficient of the ensemble of each element of
+        parameters, in the same order.
+    """
+    
+    ensembles = smallWorldEnsembles(parameters, size, seed, tries, workers, cache)
+    return [float(ensembles[elem].mean()) for elem in parameters]
+
+
+# =============================================================================
+## Degree preserving rewirings
+# =============================================================================
+
+"""
+A frame is also compared with rewirings of its own edges: double edge swaps
+(a, b), (c, d) -> (a, d), (c, b) between two edges with the same number of
+links keep the degree and the multidegree of every junction. A swap is
+rejected if it would create a loop or an edge that already exists. The swaps
+are done in batches on numpy arrays: each round pairs the edges at random
+inside each class of equal links, and every pair is swapped at once unless
+it is rejected or two swaps of the round create the same edge. The
+rewirings of an ensemble are disjoint copies of the frame rewired together,
+each in its own swap classes.
+"""
+
+
+def edgeKey(source, target, n):
+    """
+    Return a key identifying each edge whatever its orientation.
+    """
+    
+    return np.minimum(source, target) * n + np.maximum(source, target)
+
+
+def rewire(source, target, groups, rounds = 10, rng = None):
+    """
+    Return the edges after rounds of batched double edge swaps.
+
+    Parameters:
+    -----------
+    source, target: numpy arrays
+        The extremities of the edges, numbered from 0, one row per edge.
+    groups: numpy array
+        The swap class of each edge, only edges of the same class are
+        swapped (the number of links of each edge, for instance).
+    rounds: int, default 10
+        Number of rounds, each edge is proposed for one swap in each round.
+    rng: numpy random generator, default None
+        The generator, a new one if None.
+
+    Returns:
+    --------
+    source, target: numpy arrays
+        The rewired edges, in the same order. The loops are left unchanged.
+    """
+    
+    rng = np.random.default_rng() if rng is None else rng
+    source, target = source.copy(), target.copy()
+    n = int(max(source.max(), target.max())) + 1 if len(source) else 0
+    E = np.nonzero(source != target)[0]
+    
+    for r in range(rounds):
+        # random pairs of edges inside each class
+        order = E[np.lexsort((rng.random(len(E)), groups[E]))]
+        half = len(order) // 2
+        first, second = order[0:2*half:2], order[1:2*half:2]
+        same = groups[first] == groups[second]
+        first, second = first[same], second[same]
+        
+        # each pair can be swapped in two ways
+        flip = rng.random(len(second)) < 0.5
+        a, b = source[first], target[first]
+        c = np.where(flip, target[second], source[second])
+        d = np.where(flip, source[second], target[second])
+        
+        # no loop, no edge that already exists, no edge created twice
+        key1, key2 = edgeKey(a, d, n), edgeKey(c, b, n)
+        existing = np.unique(edgeKey(source, target, n))
+        ok = (a != d) & (c != b)
+        ok &= ~np.isin(key1, existing) & ~np.isin(key2, existing)
+        created, counts = np.unique(np.concatenate([key1[ok], key2[ok]]), return_counts=True)
+        twice = created[counts > 1]
+        ok &= ~np.isin(key1, twice) & ~np.isin(key2, twice)
+        
+        target[first[ok]] = d[ok]
+        source[second[ok]] = c[ok]
+        target[second[ok]] = b[ok]
+    
+    return source, target
+
+
+def rewiredEnsemble(data_edges, size = 100, rounds = 10, seed = 0):
+    """
+    Return independent rewirings of a frame keeping the degree and the
+    multidegree of each junction, see rewire.
+
+    Parameters:
+    -----------
+    data_edges: pandas dataframe
+        The edges of the frame, with one row per edge and three columns named
+        source, target and links (see utilitaries.toEdgeList).
+    size: int, default 100
+        Number of rewirings.
+    rounds: int, default 10
+        Number of rounds of swaps of each rewiring.
+    seed: int, default 0
+        Seed of the random number generator.
+
+    Returns:
+    --------
+    edge_lists: list of pandas dataframes
+        The edges of each rewiring, like data_edges.
+    """
+    
+    links = data_edges['links'].to_numpy()
+    codes, nodes = pd.factorize(np.column_stack([data_edges['source'].to_numpy(),
+                                                 data_edges['target'].to_numpy()]).ravel())
+    n, m = len(nodes), len(links)
+    
+    # the rewirings are disjoint copies of the frame, rewired at once
+    offsets = np.repeat(np.arange(size, dtype=np.int64) * n, m)
+    source = np.tile(codes[0::2], size) + offsets
+    target = np.tile(codes[1::2], size) + offsets
+    classes = int(links.max(initial=0)) + 1
+    groups = np.repeat(np.arange(size, dtype=np.int64), m) * classes + np.tile(links, size)
+    
+    source, target = rewire(source, target, groups, rounds, np.random.default_rng(seed))
+    source, target = nodes[source - offsets], nodes[target - offsets]
+    
+    edge_lists = []
+    for i in range(size):
+        edge_lists += [pd.DataFrame({'source': source[i*m:(i+1)*m], 'target': target[i*m:(i+1)*m],
+                                     'links': links})]
+    return edge_lists
+
+
+def rewiredZScore(edge_lists, size = 100, rounds = 10, seed = 0):
+    """
+    Return the z-score of the average multigraph clustering coefficient of
+    each frame against rewirings of the frame, see rewiredEnsemble.
+
+    Parameters:
+    -----------
+    edge_lists: list of pandas dataframes
+        The edges of each frame, with one row per edge and three columns named
+        source, target and links (see utilitaries.toEdgeList).
+    size, rounds, seed:
+        See rewiredEnsemble, the frame k is rewired with the seed (seed, k).
+
+    Returns:
+    --------
+    df: pandas dataframe
+        One row per frame with the columns avgWCC, nullMean, nullStd and z
+        ((avgWCC - nullMean) / nullStd, NaN if nullStd is 0).
+    """
+    
+    L = []
+    observed = batchCC(edge_lists)['avgWCC'].to_numpy()
+    for k, data_edges in enumerate(edge_lists):
+        frame_seed = np.random.SeedSequence([seed, k])
+        null = batchCC(rewiredEnsemble(data_edges, size, rounds, frame_seed))['avgWCC'].to_numpy()
+        mean, std = null.mean(), null.std(ddof=1) if size > 1 else 0.0
+        z = (observed[k] - mean) / std if std > 0 else np.nan
+        L += [[observed[k], mean, std, z]]
+    
+    return pd.DataFrame(L, columns=['avgWCC', 'nullMean', 'nullStd', 'z'])
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The clean, neighbours and clustering stages of a frame in one pass.
+"""
+
+# =============================================================================
+## Library dependancies
+# =============================================================================
+
+import os
+from pathlib import Path
+from os.path import isfile, join
+
+from clean import clean, BS_tag, cleanName
+from neighborsSearch import findPairs, verletNeighbours, pairsToCSR
+from clustering import junctionFrame
+from storage import saveFrame
+from utilitaries import saveCSR
+
+# =============================================================================
+## Pipeline
+# =============================================================================
+
+"""
+The pipeline takes each raw frame from the .rst file to the junction graph in
+memory: clean and BS_tag (clean.py), neighbours search (neighborsSearch.py),
+then junctionFrame (clustering.py). Only the junctions are saved, unless
+checkpoints of the intermediate stages are asked for. The checkpoints are
+saved like the outputs of main_clean and mainNeighbors (layout 'csr'), so
+the separate stages can start again from them.
+"""
+
+STAGES = ['clean', 'neighbors']
+
+
+def pipelineFrame(file_path, searchRadius = 1.5, box_size = 48, boundary = 'pbc',
+                  method = 'cell', chunk_size = 1024, skin = None, verlet = None,
+                  workers = 1):
+    """
+    Take one raw frame to its junctions.
+
+    Parameters:
+    -----------
+    file_path: string or Path
+        The .rst file.
+    searchRadius: float, default 1.5
+        Radius of the sphere of the neighbours search.
+    method: 'brute' or 'cell', default 'cell'
+        Algorithm used for the search, see neighborsSearch.findPairs.
+    chunk_size: int, default 1024
+        Number of rows of the distance matrix computed at once by the brute
+        search.
+    skin: float, default None
+        If given, a Verlet list is used for the search, see
+        neighborsSearch.verletNeighbours.
+    verlet: dict, default None
+        The Verlet list returned for the previous frame.
+    workers: int, default 1
+        Number of processes used for the search, see neighborsSearch.slabPairs.
+
+    Returns:
+    --------
+    sites, nearest, junctions, verlet: dataframe, tuple, dataframe, dict
+        The binding sites, their neighbours in CSR form, the junctions and
+        the Verlet list to give for the next frame (None without skin).
+        None if the boundary or the method is not understood.
+    """
+    
+    data = clean(file_path, boundary)
+    if data is None:
+        return None
+    sites = BS_tag(data)
+    
+    if skin is None:
+        pairs = findPairs(sites[['x','y','z']].to_numpy(), searchRadius,
+                          box_size, boundary, method, chunk_size, workers)
+    else:
+        pairs, verlet = verletNeighbours(sites, searchRadius, box_size,
+                                         boundary, skin, verlet, method,
+                                         chunk_size, workers)
+    if pairs is None:
+        return None
+    nearest = pairsToCSR(len(sites), *pairs)
+    
+    junctions = junctionFrame(sites, box_size, boundary, nearest=nearest)
+    
+    return sites, nearest, junctions, verlet
+
+
+def mainPipeline(dir_in, dir_out, name, searchRadius = 1.5, box_size = 48,
+                 boundary = 'pbc', method = 'cell', chunk_size = 1024, skin = None,
+                 workers = 1, fmt = 'pkl', checkpoints = None):
+    """
+    Take a bunch of raw frames to their junctions and save them in a (new)
+    directory, see pipelineFrame.
+
+    Parameters:
+    -----------
+    dir_in: string
+        Input directory, where the script will search the directory named name
+        holding the .rst files.
+    dir_out: string
+        Output directory, that the script will eventually create and where it 
+        will save the junctions in the {name} subdirectory.
+    name: string
+        Subdirectory where the script will take the files.
+    searchRadius, method, chunk_size, skin, workers:
+        See pipelineFrame.
+    fmt: 'pkl' or 'frame', default 'pkl'
+        Format of the saved files, see storage.saveFrame.
+    checkpoints: dict, default None
+        Output directory of each intermediate stage to save ('clean' and/or
+        'neighbors'), the {name} subdirectory is created in it. Nothing but
+        the junctions is saved if None.
+
+    Returns:
+    --------
+    Nothing directly. The script will save the files in a new subdirectory 
+    {name} under the output directory.
+    """
+    
+    dir_path = Path(os.getcwd()) 
+    path = dir_path.parent.joinpath(dir_in,name)
+    save_path = dir_path.parent.joinpath(dir_out,name)
+    save_path.mkdir(parents=True, exist_ok=True)
+    
+    checkpoints = {} if checkpoints is None else checkpoints
+    for stage in checkpoints:
+        if stage not in STAGES:
+            print('Stage {} is not understood, the checkpoints can be saved for'.format(stage) +
+                  ' the stages {}.'.format(', '.join(STAGES)))
+            return None
+    checkpoint_paths = {stage: dir_path.parent.joinpath(checkpoints[stage], name)
+                        for stage in checkpoints}
+    for checkpoint_path in checkpoint_paths.values():
+        checkpoint_path.mkdir(parents=True, exist_ok=True)
+    
+    # work on each files
+    file_list = sorted([f for f in os.listdir(path) if isfile(join(path, f)) and f.endswith('.rst')],
+                       key=lambda f: cleanName(f[:-4]))
+    n = len(file_list)
+    
+    verlet = None
+    for i in range(n):
+        print("{} file {:02d} / {}".format(name, i+1, n))
+        stem = cleanName(file_list[i][:-4])
+        frame = pipelineFrame(path.joinpath(file_list[i]), searchRadius, box_size,
+                              boundary, method, chunk_size, skin, verlet, workers)
+        if frame is None:
+            return None
+        sites, nearest, junctions, verlet = frame
+        
+        if 'clean' in checkpoint_paths:
+            saveFrame(sites, checkpoint_paths['clean'].joinpath(stem), fmt)
+        if 'neighbors' in checkpoint_paths:
+            save_name = checkpoint_paths['neighbors'].joinpath(stem)
+            saveFrame(sites, save_name, fmt)
+            saveCSR(str(save_name) + '.npz', *nearest)
+        saveFrame(junctions, save_path.joinpath(stem), fmt)
@@ -12,17 +12,8 @@ Created on Thu Feb 17 18:06:40 2022
 
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import networkx as nx
-import os
-import matplotlib.pyplot as plt
-import mpl_toolkits.mplot3d.axes3d as p3
 
-from mpl_toolkits.mplot3d import proj3d
-from matplotlib.patches import FancyArrowPatch
-from pathlib import Path
-from utilitaries import toEdgeList, dfListConnex, includeSJ
-from clusteringCoefficient import unweightedCC, weightedCC
+from utilitaries import dfListConnex
 
 
 
@@ -85,8 +76,6 @@ R = ['2B/6091',
      '5D/11003',
      '6E/14003']
 
-df2 = zigzag('neo_junctions',R)
-
 def meanList(L):
     s = 0
     for i in range(len(L)):
@@ -105,8 +94,11 @@ def stdList(L):
 def expandList(L,k):
     return L[k]
 
-df2['rank1'] = df2['rankList'].apply(lambda x : expandList(x,0))
-df2['rank2'] = df2['rankList'].apply(lambda x : expandList(x,1))
-df2['rank3'] = df2['rankList'].apply(lambda x : expandList(x,2))
-df2['rank4'] = df2['rankList'].apply(lambda x : expandList(x,3))
-df2['rank5'] = df2['rankList'].apply(lambda x : expandList(x,4))
\ No newline at end of file
+
+if __name__ == '__main__':
+    df2 = zigzag('neo_junctions',R)
+    df2['rank1'] = df2['rankList'].apply(lambda x : expandList(x,0))
+    df2['rank2'] = df2['rankList'].apply(lambda x : expandList(x,1))
+    df2['rank3'] = df2['rankList'].apply(lambda x : expandList(x,2))
+    df2['rank4'] = df2['rankList'].apply(lambda x : expandList(x,3))
+    df2['rank5'] = df2['rankList'].apply(lambda x : expandList(x,4))
@@ -0,0 +1,695 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Storage of the frames: pickles, columnar frames and run containers.
+"""
+
+# =============================================================================
+## Library dependancies
+# =============================================================================
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from os.path import isfile, isdir, join
+
+# =============================================================================
+## Columnar frames
+# =============================================================================
+
+"""
+A frame saved in the columnar format is a directory {name}.frame holding one
+.npy file per array and a schema.json describing the columns:
+    - 'array' columns (numbers) are saved as they are,
+    - 'string' columns are saved as fixed width unicode arrays, plus a
+      boolean array of the missing values if there are some,
+    - 'list' columns (list of numbers in each row, like neighbors_list) are
+      saved as an offsets array plus the flat values,
+    - 'records' columns (list of fixed length lists in each row, like members,
+      neighbors or nearest) are saved as an offsets array plus one flat array
+      per field.
+The rows of a list or records column i are values[offsets[i]:offsets[i+1]].
+Every array can be read with np.load(mmap_mode='r'), nothing is unpickled.
+"""
+
+FORMATS = {'pkl': '.pkl', 'frame': '.frame'}
+
+
+def columnKind(column):
+    """
+    Return the kind of a dataframe column in the columnar format.
+
+    Parameters:
+    -----------
+    column: pandas series
+        The column.
+
+    Returns:
+    --------
+    kind, width: string, int
+        The kind of the column ('array', 'string', 'list' or 'records') and
+        the number of fields of a 'records' column (0 otherwise).
+    """
+    
+    if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column):
+        return 'array', 0
+    
+    for cell in column:
+        if (cell is None) or (isinstance(cell, float) and np.isnan(cell)):
+            # missing values say nothing about the kind
+            continue
+        elif isinstance(cell, str):
+            return 'string', 0
+        elif isinstance(cell, (int, float, np.number)):
+            return 'array', 0
+        elif isinstance(cell, (list, tuple)):
+            for elem in column:
+                if len(elem) > 0:
+                    if isinstance(elem[0], (list, tuple)):
+                        return 'records', len(elem[0])
+                    return 'list', 0
+            return 'list', 0
+        else:
+            raise TypeError('Column {} holds {} objects, which cannot be saved'.format(column.name, type(cell)) +
+                            ' in the columnar format.')
+    return 'array', 0
+
+
+def encodeFrame(df):
+    """
+    Return the arrays and the schema of a dataframe in the columnar format.
+
+    Parameters:
+    -----------
+    df: pandas dataframe
+        The frame to encode.
+
+    Returns:
+    --------
+    arrays: dict
+        The numpy arrays, by file name (without the .npy suffix).
+    schema: dict
+        The description of the columns, see the module documentation.
+    """
+    
+    arrays = {}
+    columns = []
+    
+    for k, name in enumerate(df.columns):
+        column = df[name]
+        kind, width = columnKind(column)
+        key = str(k)
+        if kind == 'array':
+            arrays[key] = np.array(column.tolist()) if column.dtype == object else column.to_numpy()
+        elif kind == 'string':
+            missing = column.isna().to_numpy()
+            arrays[key] = np.array(['' if m else cell for m, cell in zip(missing, column)], dtype=str)
+            if missing.any():
+                arrays[key + '.missing'] = missing
+        else:
+            lengths = column.apply(len).to_numpy()
+            arrays[key + '.offsets'] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+            flat = [elem for cell in column for elem in cell]
+            if kind == 'list':
+                arrays[key + '.values'] = np.array(flat)
+            else:
+                for f in range(width):
+                    arrays['{}.{}'.format(key, f)] = np.array([elem[f] for elem in flat])
+        columns += [{'name': str(name), 'kind': kind, 'width': width}]
+    
+    schema = {'columns': columns, 'length': len(df)}
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        arrays['index'] = df.index.to_numpy()
+        schema['index'] = True
+    
+    return arrays, schema
+
+
+def decodeFrame(arrays, schema, columns = None):
+    """
+    Return the dataframe described by arrays and schema, see encodeFrame.
+
+    Parameters:
+    -----------
+    arrays: dict
+        The numpy arrays, by file name (without the .npy suffix).
+    schema: dict
+        The description of the columns.
+    columns: list of strings, default None
+        The columns to decode, all of them if None.
+
+    Returns:
+    --------
+    df: pandas dataframe
+        The decoded frame.
+    """
+    
+    data = {}
+    for k, column in enumerate(schema['columns']):
+        name, kind = column['name'], column['kind']
+        if (columns is not None) and (name not in columns):
+            continue
+        key = str(k)
+        if kind == 'array':
+            data[name] = arrays[key]
+            continue
+        elif kind == 'string':
+            data[name] = arrays[key]
+            if key + '.missing' in arrays:
+                data[name] = np.asarray(data[name]).astype(object)
+                data[name][np.asarray(arrays[key + '.missing'])] = None
+            continue
+        
+        bounds = np.asarray(arrays[key + '.offsets']).tolist()
+        if kind == 'list':
+            flat = np.asarray(arrays[key + '.values']).tolist()
+        else:
+            fields = [np.asarray(arrays['{}.{}'.format(key, f)]).tolist()
+                      for f in range(column['width'])]
+            flat = [list(elem) for elem in zip(*fields)]
+        data[name] = [flat[bounds[i]:bounds[i+1]] for i in range(schema['length'])]
+    
+    index = arrays['index'] if schema.get('index') else None
+    return pd.DataFrame(data, index=index)
+
+
+def writeFrame(df, frame_path):
+    """
+    Save a dataframe in the columnar format. The frame is written in a
+    temporary directory first, then renamed.
+
+    Parameters:
+    -----------
+    df: pandas dataframe
+        The frame to save.
+    frame_path: string or Path
+        Name of the frame directory, usually ending in .frame.
+
+    Returns:
+    --------
+    Nothing directly. The frame is saved in frame_path.
+    """
+    
+    frame_path = Path(frame_path)
+    arrays, schema = encodeFrame(df)
+    
+    tmp_path = frame_path.with_name(frame_path.name + '.tmp')
+    if isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+    for key, array in arrays.items():
+        np.save(tmp_path.joinpath(key + '.npy'), array, allow_pickle=False)
+    with open(tmp_path.joinpath('schema.json'), 'w') as f:
+        json.dump(schema, f)
+    
+    if isdir(frame_path):
+        shutil.rmtree(frame_path)
+    os.replace(tmp_path, frame_path)
+
+
+def readArrays(frame_path, mmap_mode = 'r'):
+    """
+    Return the raw arrays and the schema of a frame saved in the columnar
+    format, without building the dataframe.
+
+    Parameters:
+    -----------
+    frame_path: string or Path
+        Name of the frame directory.
+    mmap_mode: string or None, default 'r'
+        Passed to np.load, with 'r' the arrays are memory mapped.
+
+    Returns:
+    --------
+    arrays, schema: dict, dict
+        See encodeFrame.
+    """
+    
+    frame_path = Path(frame_path)
+    with open(frame_path.joinpath('schema.json')) as f:
+        schema = json.load(f)
+    
+    arrays = {}
+    for file in os.listdir(frame_path):
+        if file.endswith('.npy'):
+            arrays[file[:-4]] = np.load(frame_path.joinpath(file), mmap_mode=mmap_mode,
+                                        allow_pickle=False)
+    return arrays, schema
+
+
+def readFrame(frame_path, columns = None):
+    """
+    Return a dataframe saved in the columnar format.
+
+    Parameters:
+    -----------
+    frame_path: string or Path
+        Name of the frame directory.
+    columns: list of strings, default None
+        The columns to read, all of them if None.
+
+    Returns:
+    --------
+    df: pandas dataframe
+        The frame.
+    """
+    
+    arrays, schema = readArrays(frame_path)
+    return decodeFrame(arrays, schema, columns)
+
+
+# =============================================================================
+## Readers and writers used by the stages
+# =============================================================================
+
+
+def frameStem(file_name):
+    """
+    Return the name of a frame without its format suffix.
+
+    Parameters:
+    -----------
+    file_name: string
+        Name of the .pkl file or .frame directory.
+
+    Returns:
+    --------
+    stem: string
+        The name without the .pkl or .frame suffix.
+    """
+    
+    for suffix in FORMATS.values():
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+    return file_name
+
+
+def saveFrame(df, file_path, fmt = 'pkl'):
+    """
+    Save a frame of any stage as a pickle or in the columnar format.
+
+    Parameters:
+    -----------
+    df: pandas dataframe
+        The frame to save.
+    file_path: string or Path
+        Name of the frame without suffix, the one of fmt is appended.
+    fmt: 'pkl' or 'frame', default 'pkl'
+        Format of the file.
+
+    Returns:
+    --------
+    save_name: Path
+        Name of the saved file.
+    """
+    
+    save_name = Path(str(file_path) + FORMATS[fmt])
+    if fmt == 'frame':
+        writeFrame(df, save_name)
+    else:
+        # written in a temporary file first, then renamed
+        tmp_name = save_name.with_name(save_name.name + '.tmp')
+        df.to_pickle(tmp_name)
+        os.replace(tmp_name, save_name)
+    return save_name
+
+
+def loadFrame(file_path):
+    """
+    Load a frame of any stage saved by saveFrame, the format is given by the
+    suffix.
+
+    Parameters:
+    -----------
+    file_path: string or Path
+        Name of the .pkl file or .frame directory.
+
+    Returns:
+    --------
+    df: pandas dataframe
+        The frame.
+    """
+    
+    if str(file_path).endswith('.frame'):
+        return readFrame(file_path)
+    return pd.read_pickle(file_path)
+
+
+def listFrames(path):
+    """
+    Return the sorted names of the frames (.pkl files or .frame directories)
+    in a directory.
+
+    Parameters:
+    -----------
+    path: string or Path
+        The directory.
+
+    Returns:
+    --------
+    file_list: list of strings
+        The names of the frames, sorted.
+    """
+    
+    file_list = []
+    for name in os.listdir(path):
+        if (name.endswith('.pkl') and isfile(join(path, name))) or \
+           (name.endswith('.frame') and isdir(join(path, name))):
+            file_list.append(name)
+    file_list.sort()
+    return file_list
+
+
+# =============================================================================
+## Run containers
+# =============================================================================
+
+"""
+A run container {name}.run holds all the frames of one run for one stage in
+a single file:
+    - an 8 bytes magic number,
+    - the arrays of each frame (see encodeFrame), aligned on 64 bytes,
+    - a json index giving for each frame its name, timestep, byte offset and
+      length, schema and the offset, dtype and shape of each array,
+    - the offset of the index as a little endian uint64, then the magic number.
+A frame, or a range of frames, is read by memory mapping its arrays, without
+listing a directory or opening one file per frame.
+"""
+
+RUN_SUFFIX = '.run'
+RUN_MAGIC = b'DROPRUN1'
+RUN_ALIGN = 64
+
+
+def frameTimestep(file_name):
+    """
+    Return the timestep of a frame, given by the trailing digits of its name.
+
+    Parameters:
+    -----------
+    file_name: string
+        Name of the frame, with or without suffix.
+
+    Returns:
+    --------
+    timestep: int or None
+        The timestep, None if the name does not end with digits.
+    """
+    
+    stem = frameStem(file_name)
+    digits = len(stem) - len(stem.rstrip('0123456789'))
+    if digits == 0:
+        return None
+    return int(stem[-digits:])
+
+
+def packRun(frames, run_path):
+    """
+    Save frames in a run container. The container is written in a temporary
+    file first, then renamed.
+
+    Parameters:
+    -----------
+    frames: iterable of (string, pandas dataframe)
+        The name and the dataframe of each frame, in the order of the run.
+    run_path: string or Path
+        Name of the container, usually ending in .run.
+
+    Returns:
+    --------
+    Nothing directly. The container is saved in run_path.
+    """
+    
+    run_path = Path(run_path)
+    tmp_path = run_path.with_name(run_path.name + '.tmp')
+    
+    index = []
+    with open(tmp_path, 'wb') as f:
+        f.write(RUN_MAGIC)
+        for name, df in frames:
+            arrays, schema = encodeFrame(df)
+            start = f.tell()
+            entry = {'name': name, 'timestep': frameTimestep(name), 'schema': schema,
+                     'arrays': {}}
+            for key, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                f.write(b'\0' * (-f.tell() % RUN_ALIGN))
+                entry['arrays'][key] = {'offset': f.tell(), 'dtype': array.dtype.str,
+                                        'shape': list(array.shape)}
+                f.write(array.tobytes())
+            entry['offset'] = start
+            entry['length'] = f.tell() - start
+            index += [entry]
+        
+        index_offset = f.tell()
+        f.write(json.dumps({'frames': index}).encode())
+        f.write(np.uint64(index_offset).astype('<u8').tobytes())
+        f.write(RUN_MAGIC)
+    
+    os.replace(tmp_path, run_path)
+
+
+def packFrames(path, run_path = None):
+    """
+    Save all the frames of a directory (see listFrames) in a run container.
+
+    Parameters:
+    -----------
+    path: string or Path
+        The directory of the run.
+    run_path: string or Path, default None
+        Name of the container, the directory name followed by .run if None.
+
+    Returns:
+    --------
+    run_path: Path
+        Name of the saved container.
+    """
+    
+    path = Path(path)
+    if run_path is None:
+        run_path = path.with_name(path.name + RUN_SUFFIX)
+    frames = ((frameStem(file), loadFrame(path.joinpath(file))) for file in listFrames(path))
+    packRun(frames, run_path)
+    return Path(run_path)
+
+
+def readRunIndex(run_path):
+    """
+    Return the frame index of a run container.
+
+    Parameters:
+    -----------
+    run_path: string or Path
+        Name of the container.
+
+    Returns:
+    --------
+    index: list of dicts
+        For each frame: name, timestep, offset, length, schema and arrays.
+    """
+    
+    with open(run_path, 'rb') as f:
+        f.seek(-16, os.SEEK_END)
+        trailer = f.read(16)
+        if trailer[8:] != RUN_MAGIC:
+            raise ValueError('{} is not a run container.'.format(run_path))
+        index_offset = int(np.frombuffer(trailer[:8], dtype='<u8')[0])
+        end = f.seek(0, os.SEEK_END) - 16
+        f.seek(index_offset)
+        return json.loads(f.read(end - index_offset).decode())['frames']
+
+
+def runPosition(index, timestep):
+    """
+    Return the position of a timestep in the index of a run container.
+
+    Parameters:
+    -----------
+    index: list of dicts
+        The index, see readRunIndex.
+    timestep: int
+        The timestep.
+
+    Returns:
+    --------
+    k: int
+        Position of the frame of this timestep.
+    """
+    
+    for k, entry in enumerate(index):
+        if entry['timestep'] == timestep:
+            return k
+    raise KeyError('No frame at timestep {}.'.format(timestep))
+
+
+def readRunFrame(run_path, k, index = None, columns = None):
+    """
+    Return the frame k of a run container.
+
+    Parameters:
+    -----------
+    run_path: string or Path
+        Name of the container.
+    k: int
+        Position of the frame in the run, see runPosition to get it from a
+        timestep.
+    index: list of dicts, default None
+        The index of the container, read if None.
+    columns: list of strings, default None
+        The columns to read, all of them if None.
+
+    Returns:
+    --------
+    df: pandas dataframe
+        The frame.
+    """
+    
+    if index is None:
+        index = readRunIndex(run_path)
+    entry = index[k]
+    
+    arrays = {}
+    for key, array in entry['arrays'].items():
+        dtype, shape = np.dtype(array['dtype']), tuple(array['shape'])
+        if int(np.prod(shape)) == 0:
+            arrays[key] = np.empty(shape, dtype=dtype)
+        else:
+            arrays[key] = np.memmap(run_path, dtype=dtype, mode='r',
+                                    offset=array['offset'], shape=shape)
+    return decodeFrame(arrays, entry['schema'], columns)
+
+
+def readRunFrames(run_path, start = 0, stop = None, columns = None):
+    """
+    Return the frames start to stop (excluded) of a run container.
+
+    Parameters:
+    -----------
+    run_path: string or Path
+        Name of the container.
+    start, stop: int, default 0 and None
+        Range of the frames, up to the last one if stop is None.
+    columns: list of strings, default None
+        The columns to read, all of them if None.
+
+    Returns:
+    --------
+    df_list: list of pandas dataframes
+        The frames, in the order of the run.
+    """
+    
+    index = readRunIndex(run_path)
+    if stop is None:
+        stop = len(index)
+    return [readRunFrame(run_path, k, index, columns) for k in range(start, min(stop, len(index)))]
+
+
+def currentRun(path):
+    """
+    Return the container path.run if it holds the current frames of the run:
+    the directory path has no frames, or it has the same frames and none of
+    them is newer than the container. A container older than the directory
+    (a stage was run again after packing) is not used.
+
+    Parameters:
+    -----------
+    path: string or Path
+        The run, without the .run suffix.
+
+    Returns:
+    --------
+    run_path: Path or None
+        The container, None if there is none or it is out of date.
+    """
+    
+    path = Path(path)
+    run_path = path.with_name(path.name + RUN_SUFFIX)
+    if not isfile(run_path):
+        return None
+    file_list = listFrames(path) if isdir(path) else []
+    if not file_list:
+        return run_path
+    
+    names = [entry['name'] for entry in readRunIndex(run_path)]
+    newest = max(os.path.getmtime(path.joinpath(file)) for file in file_list)
+    if (names == [frameStem(file) for file in file_list]) and (os.path.getmtime(run_path) >= newest):
+        return run_path
+    return None
+
+
+def readRun(path, start = 0, stop = None, columns = None):
+    """
+    Return the frames start to stop (excluded) of a run, read from the
+    container path.run when it is up to date (see currentRun) and from the
+    directory path otherwise. Only these frames are read.
+
+    Parameters:
+    -----------
+    path: string or Path
+        The run, without the .run suffix.
+    start, stop: int, default 0 and None
+        Range of the frames, up to the last one if stop is None.
+    columns: list of strings, default None
+        The columns to read, all of them if None.
+
+    Returns:
+    --------
+    df_list: list of pandas dataframes
+        The frames, in the order of the run.
+    """
+    
+    path = Path(path)
+    run_path = currentRun(path)
+    if run_path is not None:
+        return readRunFrames(run_path, start, stop, columns)
+    df_list = [loadFrame(path.joinpath(file)) for file in listFrames(path)[start:stop]]
+    if columns is not None:
+        df_list = [df[[name for name in df.columns if name in columns]] for df in df_list]
+    return df_list
+
+
+def loadRun(path):
+    """
+    Return all the frames of a run, see readRun.
+
+    Parameters:
+    -----------
+    path: string or Path
+        The run, without the .run suffix.
+
+    Returns:
+    --------
+    df_list: list of pandas dataframes
+        The frames, in the order of the run.
+    """
+    
+    return readRun(path)
+
+
+def listRuns(path):
+    """
+    Return the sorted names of the runs (directories or .run containers) in a
+    directory.
+
+    Parameters:
+    -----------
+    path: string or Path
+        The directory.
+
+    Returns:
+    --------
+    run_list: list of strings
+        The names of the runs, without the .run suffix, sorted.
+    """
+    
+    run_list = set()
+    for name in os.listdir(path):
+        if isdir(join(path, name)):
+            run_list.add(name)
+        elif name.endswith(RUN_SUFFIX) and isfile(join(path, name)):
+            run_list.add(name[:-len(RUN_SUFFIX)])
+    return sorted(run_list)
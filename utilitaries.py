@@ -14,77 +14,173 @@ import pandas as pd
 import numpy as np
 import os
 from pathlib import Path
-from os.path import isfile, join
+
+from storage import loadRun
 
 # =============================================================================
 ## Utilitary functions
 # =============================================================================
 
 
-def simpleToEdgeList(data, links):
+def edgeList(source, target, links, multigraph = False):
+    """
+    Return the edges between source and target, each edge once with the
+    number of links of its first occurrence. An edge (i, j) and an edge (j, i)
+    are the same edge, kept with the orientation it first appears with.
+
+    Parameters:
+    -----------
+    source, target, links: numpy arrays
+        The extremities of the edges and their number of links, one edge may
+        appear several times.
+    multigraph: bool, default False
+        If True, each edge is repeated as many times as it has links.
+
+    Returns:
+    --------
+    df: pandas dataframe
+        The edges, with three columns named source, target and links.
+    """
+    
+    # the same pair (min, max) for both orientations of an edge
+    canonical = np.stack([np.minimum(source, target), np.maximum(source, target)], axis=1)
+    _, first = np.unique(canonical, axis=0, return_index=True)
+    first.sort()
+    
+    df = pd.DataFrame({'source': source[first], 'target': target[first],
+                       'links': links[first]})
+    if multigraph:
+        df = df.loc[df.index.repeat(df['links'])].reset_index(drop=True)
+    
+    return df
+
+
+def simpleToEdgeList(data, links, multigraph = False):
     """
     Return a new dataframe containing the edges spanned by the junctions and
-    their neighbors, multiple edges are returned if there is multiple links 
-    between them.
+    their neighbors, with the same number of links for each edge.
 
     Parameters:
     -----------
     data: pandas dataframe
-        data must contain at least two columns named junction and neighbors.   
+        data must contain at least two columns named junction and neighbors
+        (a list of junctions in each row).
+    links: int
+        Number of links of each edge.
+    multigraph: bool, default False
+        If True, each edge is repeated links times, see edgeList.
 
     Returns:
     --------
     df: pandas dataframe
         A new dataframe containing the edges spanned by the junctions and
-        their neighbors, multiple edges are returned if there is multiple links 
-        between them.
+        their neighbors, with three columns named source, target and links.
     """
     
-    L = []
-    
-    for i in range(len(data)):
-        for j in range(len(data.at[i,'neighbors'])):
-            if ([data.at[i,'junction'], data.at[i,'neighbors'][j]] in L) or ([data.at[i,'neighbors'][j],data.at[i,'junction']] in L):
-                pass
-            else:
-                L += [[data.at[i,'junction'], data.at[i,'neighbors'][j]]]*links
-
-    df = pd.DataFrame(L,columns=['source', 'target'])
+    lengths = data['neighbors'].map(len).to_numpy(dtype=np.int64)
+    source = np.repeat(data['junction'].to_numpy(), lengths)
+    target = np.array([elem for cell in data['neighbors'] for elem in cell], dtype=source.dtype)
     
-    return df
+    return edgeList(source, target, np.full(len(source), links, dtype=np.int64), multigraph)
 
-def toEdgeList(data):
+def toEdgeList(data, multigraph = False):
     """
     Return a new dataframe containing the edges spanned by the junctions and
-    their neighbors, multiple edges are returned if there is multiple links 
-    between them.
+    their neighbors, each edge once with its number of links.
 
     Parameters:
     -----------
     data: pandas dataframe
         data must contain at least two columns named junction and neighbors.   
+    multigraph: bool, default False
+        If True, multiple edges are returned if there is multiple links 
+        between them, like a networkx multigraph expects, see edgeList.
 
     Returns:
     --------
     df: pandas dataframe
         A new dataframe containing the edges spanned by the junctions and
-        their neighbors, multiple edges are returned if there is multiple links 
-        between them.
+        their neighbors, with three columns named source, target and links.
     """
     
-    L = []
+    lengths = data['neighbors'].map(len).to_numpy(dtype=np.int64)
+    source = np.repeat(data['junction'].to_numpy(), lengths)
+    flat = [elem for cell in data['neighbors'] for elem in cell]
+    target = np.array([elem[0] for elem in flat], dtype=source.dtype)
+    links = np.array([elem[2] for elem in flat], dtype=np.int64)
     
-    for i in range(len(data)):
-        for j in range(len(data.at[i,'neighbors'])):
-            if ([data.at[i,'junction'], data.at[i,'neighbors'][j][0], data.at[i,'neighbors'][j][2]] in L) or ([data.at[i,'neighbors'][j][0],data.at[i,'junction'], data.at[i,'neighbors'][j][2]] in L):
-                pass
-            else:
-                L += [[data.at[i,'junction'], data.at[i,'neighbors'][j][0], data.at[i,'neighbors'][j][2]]]*data.at[i,'neighbors'][j][2]
-            #print(L)
+    return edgeList(source, target, links, multigraph)
+
+
+def pairDistance(A, B, box_size = 48, boundary = 'pbc'):
+    """
+    Return the distances between the points of A and B, with periodic or non
+    periodic boundary. A and B are broadcast against each other.
+
+    Parameters:
+    -----------
+    A, B: numpy arrays
+        Arrays whose last axis holds the x, y and z coordinates.
+    box_size: int
+        Size of the simulation box.
+    boundary: 'pbc' or 'npbc', default 'pbc'
+        Type of boundary.
 
-    df = pd.DataFrame(L,columns=['source', 'target', 'links'])
+    Returns:
+    --------
+    D: numpy array
+        The euclidean distance (minimum image for 'pbc') between A and B.
+    """
     
-    return df
+    x_dist, y_dist, z_dist = np.moveaxis(np.abs(A - B), -1, 0)
+    if boundary == 'pbc':
+        x_dist = np.minimum(box_size - x_dist, x_dist)
+        y_dist = np.minimum(box_size - y_dist, y_dist)
+        z_dist = np.minimum(box_size - z_dist, z_dist)
+    
+    # float_power calls pow like the former scalar code did, so the distances
+    # are the same to the last bit
+    return np.sqrt(np.float_power(x_dist, 2) + np.float_power(y_dist, 2)
+                   + np.float_power(z_dist, 2))
+
+
+def saveCSR(file_path, offsets, indices, distances):
+    """
+    Save a neighbour list in compressed sparse row (CSR) form.
+
+    Parameters:
+    -----------
+    file_path: string or Path
+        Name of the .npz file.
+    offsets, indices, distances: numpy arrays
+        The neighbours of the point i are indices[offsets[i]:offsets[i+1]],
+        at distances[offsets[i]:offsets[i+1]].
+
+    Returns:
+    --------
+    Nothing directly. The arrays are saved in file_path.
+    """
+    
+    np.savez(file_path, offsets=offsets, indices=indices, distances=distances)
+
+
+def loadCSR(file_path):
+    """
+    Load a neighbour list saved by saveCSR.
+
+    Parameters:
+    -----------
+    file_path: string or Path
+        Name of the .npz file.
+
+    Returns:
+    --------
+    offsets, indices, distances: numpy arrays
+        The neighbour list in compressed sparse row (CSR) form.
+    """
+    
+    with np.load(file_path) as csr:
+        return csr['offsets'], csr['indices'], csr['distances']
 
 
 def dfListConnex(dir_in, name):
@@ -97,7 +193,8 @@ def dfListConnex(dir_in, name):
     dir_in: string
         Input directory, where the script will search the directory named name.
     name: string
-        Subdirectory where the script will take the files.
+        Subdirectory where the script will take the files, or run container
+        name.run.
 
     Returns:
     --------
@@ -109,19 +206,9 @@ def dfListConnex(dir_in, name):
     dir_path = Path(os.getcwd()) 
     path = dir_path.parent.joinpath(dir_in,name)
     
-    # work on each files
-    onlyfiles = [f for f in os.listdir(path) if isfile(join(path, f))]
-    
-    file_list = []
-    for filename in onlyfiles:
-        if filename.endswith('.pkl'):
-            file_list.append(filename)
-    file_list.sort()
-    
+    # work on each frames, from the run container if it is up to date
     df_list = []
-    for i in range(len(file_list)):
-        file_path = os.path.join(path,file_list[i])
-        df = pd.read_pickle(file_path)
+    for df in loadRun(path):
         
         n = len(df)
         L = df['component'].to_list()
@@ -175,4 +262,23 @@ def includeSJ(data, y = True):
         data4.reset_index(inplace=True)
         data4.drop('index',axis=1,inplace=True)
         
-        return data4
\ No newline at end of file
+        return data4
+
+
+# =============================================================================
+## Tests
+# =============================================================================
+
+if __name__ == '__main__':
+    # a frame without junctions gives an empty edge list
+    empty = pd.DataFrame({'junction': pd.Series([], dtype='int64'),
+                          'neighbors': pd.Series([], dtype=object)})
+    for edges in [toEdgeList(empty), toEdgeList(empty, True), simpleToEdgeList(empty, 1)]:
+        assert edges.empty and list(edges.columns) == ['source', 'target', 'links']
+    
+    # the edges of both orientations are merged
+    data = pd.DataFrame({'junction': [0, 1, 2], 'neighbors': [[(1, 0, 2)], [(0, 0, 2), (2, 0, 1)], []]})
+    edges = toEdgeList(data)
+    assert edges.values.tolist() == [[0, 1, 2], [1, 2, 1]]
+    assert len(toEdgeList(data, True)) == 3
+    print('utilitaries: tests passed')